@@ -13,10 +13,16 @@ License: MIT, see LICENSE file
 """
 
 
+import asyncio
 import datetime
+import functools
 import logging
+import os
+import re
+import shutil
 import subprocess
 import sys
+import threading
 
 # local module
 
@@ -28,6 +34,8 @@ import processwrappers
 #
 
 
+LOGGER = logging.getLogger(__name__)
+
 RETURNCODE_OK = 0
 RETURNCODE_ERROR = 1
 
@@ -38,6 +46,31 @@ DEFAULT_GIT = 'git'
 CONFIG_GLOBAL = '--global'
 CONFIG_LOCAL = '--local'
 
+# Encoding of git command output
+OUTPUT_ENCODING = 'UTF-8'
+
+# Version numbers in 'git --version' output
+PRX_GIT_VERSION = re.compile(r'(\d+)\.(\d+)(?:\.(\d+))?')
+
+# Git version assumed if it cannot be determined
+# (any current git is newer than all versions checked by the scripts)
+ASSUMED_GIT_VERSION = (2, 0)
+
+# Maximum number of git processes run concurrently
+MAX_CONCURRENT_PROCESSES = min(32, processwrappers.get_available_cpus() * 2)
+
+# Popen() options for read-only git commands:
+# not closing file descriptors allows CPython to use posix_spawn()
+# instead of fork() + exec() where available, which is much cheaper
+# for large processes. The subprocess module creates the pipes
+# it uses as non-inheritable, so no file descriptors leak
+# into these short-lived processes anyway.
+if hasattr(os, 'posix_spawn'):
+    READ_ONLY_SPAWN_OPTIONS = dict(close_fds=False)
+else:
+    READ_ONLY_SPAWN_OPTIONS = {}
+#
+
 
 #
 # Helper Functions
@@ -52,26 +85,61 @@ def exit_with_error(msg, *args):
         msg = msg % args
     #
     for line in msg.splitlines():
-        logging.error(line)
+        LOGGER.error(line)
     #
-    logging.info('Script aborted at %s', datetime.datetime.now())
+    LOGGER.info('Script aborted at %s', datetime.datetime.now())
     sys.exit(RETURNCODE_ERROR)
 
 
+@functools.lru_cache(maxsize=None)
+def get_git_version(git_command=DEFAULT_GIT):
+    """Return the version of git_command as a tuple of integers
+    (e.g. (2, 39, 2)). If it could not be determined,
+    log a warning and return ASSUMED_GIT_VERSION.
+    'git --version' is run only once per git command.
+    """
+    command_result = processwrappers.get_command_result(
+        [git_command, '--version'],
+        check=False,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        encoding=OUTPUT_ENCODING,
+        errors='replace',
+        loglevel=logging.DEBUG)
+    version_match = PRX_GIT_VERSION.search(command_result.stdout)
+    if not version_match:
+        LOGGER.warning(
+            'Could not determine the git version from %r,'
+            ' assuming version %s.',
+            command_result.stdout.strip(),
+            '.'.join(str(part) for part in ASSUMED_GIT_VERSION))
+        return ASSUMED_GIT_VERSION
+    #
+    return tuple(int(part) for part in version_match.groups() if part)
+
+
+def as_text(output):
+    """Return output (bytes or str) as str"""
+    if isinstance(output, bytes):
+        return output.decode(OUTPUT_ENCODING, errors='replace')
+    #
+    return output
+
+
 def process_error_data(error):
     """Return data from a CalledProcessError as a single string"""
-    lines = [
+    sections = [
         '[Command failed] %s' % processwrappers.future_shlex_join(error.cmd),
         'Returncode: %s' % error.returncode]
-    if error.stderr:
-        lines.append('___ Standard error ___')
-        lines.extend(error.stderr.decode().splitlines())
-    #
-    if error.stdout:
-        lines.append('___ Standard output ___')
-        lines.extend(error.stdout.decode().splitlines())
+    for (heading, output) in (
+            ('___ Standard error ___', error.stderr),
+            ('___ Standard output ___', error.stdout)):
+        if output:
+            sections.append(heading)
+            sections.append(as_text(output).rstrip('\n'))
+        #
     #
-    return '\n'.join(lines)
+    return '\n'.join(sections)
 
 
 def get_command_result(*command, exit_on_error=True, **kwargs):
@@ -103,38 +171,210 @@ class BaseGitWrapper:
     def __init__(self,
                  env=None,
                  git_command=DEFAULT_GIT):
-        """Set the env and git_command attributes"""
+        """Set the env and git_command attributes,
+        resolving git_command to its full path once
+        instead of having it looked up in PATH on each call
+        """
         self.env = env
-        self.git_command = git_command
+        self.git_command = shutil.which(git_command) or git_command
 
     def get_output(self, *arguments, log_output=True, **kwargs):
         """Run git with the specified arguments
         and return its output (stderr and stdout) combined.
+        Both streams are written to a single pipe,
+        and the output is decoded by the subprocess module (text mode).
+        """
+        kwargs.update(
+            dict(stdout=subprocess.PIPE,
+                 stderr=subprocess.STDOUT,
+                 encoding=OUTPUT_ENCODING,
+                 errors='replace',
+                 loglevel=logging.DEBUG))
+        kwargs.setdefault('env', self.env)
+        command_result = get_command_result(
+            self.git_command, *arguments, **kwargs)
+        return self.__log_output(command_result.stdout, log_output=log_output)
+
+    def get_stdout(self, *arguments, log_output=True, **kwargs):
+        """Run git with the specified arguments
+        and return its standard output only.
+        Standard error is captured separately and only logged,
+        so warnings written there cannot break callers
+        parsing the output.
         """
         kwargs.update(
             dict(stdout=subprocess.PIPE,
                  stderr=subprocess.PIPE,
+                 encoding=OUTPUT_ENCODING,
+                 errors='replace',
                  loglevel=logging.DEBUG))
         kwargs.setdefault('env', self.env)
         command_result = get_command_result(
             self.git_command, *arguments, **kwargs)
-        stderr_text = command_result.stderr.decode()
-        stdout_text = command_result.stdout.decode()
-        if log_output:
-            for stderr_line in stderr_text.splitlines():
-                logging.debug('[Command stderr] %s', stderr_line)
+        self.__log_stderr(command_result.stderr)
+        return self.__log_output(command_result.stdout, log_output=log_output)
+
+    def get_result(self, *arguments, **kwargs):
+        """Run git with the specified arguments
+        and return the result (a subprocess.CompletedProcess instance)
+        with stdout and stderr captured separately as text,
+        without exiting on a non-zero returncode
+        """
+        kwargs.update(
+            dict(stdout=subprocess.PIPE,
+                 stderr=subprocess.PIPE,
+                 encoding=OUTPUT_ENCODING,
+                 errors='replace',
+                 exit_on_error=False,
+                 loglevel=logging.DEBUG))
+        kwargs.setdefault('env', self.env)
+        return get_command_result(self.git_command, *arguments, **kwargs)
+
+    def get_streamed_result(self, *arguments, **kwargs):
+        """Run git with the specified arguments,
+        logging its output (both streams at INFO level)
+        while it is running, and return the result
+        (a subprocess.CompletedProcess instance with
+        stdout and stderr as bytes) without exiting on errors.
+        """
+        kwargs.setdefault('env', self.env)
+        return processwrappers.long_running_process_result(
+            [self.git_command, *arguments],
+            check=False,
+            stderr_loglevel=logging.INFO,
+            stdout_loglevel=logging.INFO,
+            output_encoding=OUTPUT_ENCODING,
+            loglevel=logging.INFO,
+            **kwargs)
+
+    def get_streamed_returncode(self,
+                                *arguments,
+                                exit_on_error=True,
+                                **kwargs):
+        """Run git with the specified arguments,
+        logging stdout (without collecting it) while it is running
+        and passing stderr through (so prompts, e.g. for passwords,
+        are visible immediately). Return the command returncode.
+        If "exit_on_error" is set True (the default),
+        the calling script will exit with an error mesage
+        if the command returncode is non-zero.
+        """
+        command_result = self.get_streamed_result(
+            *arguments, discard_stdout=True, passthru_stderr=True, **kwargs)
+        if command_result.returncode and exit_on_error:
+            exit_with_error(
+                process_error_data(
+                    subprocess.CalledProcessError(
+                        command_result.returncode,
+                        command_result.args)))
+        #
+        return command_result.returncode
+
+    async def get_output_async(self,
+                               *arguments,
+                               exit_on_error=True,
+                               log_output=True,
+                               **kwargs):
+        """Coroutine running git with the specified arguments
+        in an asynchronous subprocess,
+        returning its standard output.
+        Standard error is captured separately and only logged.
+        """
+        command = [self.git_command, *arguments]
+        kwargs.update(
+            dict(stdout=subprocess.PIPE,
+                 stderr=subprocess.PIPE))
+        kwargs.setdefault('env', self.env)
+        LOGGER.debug(
+            '[Executing command] %s',
+            processwrappers.future_shlex_join(command))
+        process = await asyncio.create_subprocess_exec(*command, **kwargs)
+        stdout_data, stderr_data = await process.communicate()
+        if process.returncode and exit_on_error:
+            exit_with_error(
+                process_error_data(
+                    subprocess.CalledProcessError(
+                        process.returncode,
+                        command,
+                        output=stdout_data,
+                        stderr=stderr_data)))
+        #
+        self.__log_stderr(as_text(stderr_data))
+        return self.__log_output(as_text(stdout_data), log_output=log_output)
+
+    async def get_result_async(self, *arguments, **kwargs):
+        """Coroutine running git with the specified arguments
+        in an asynchronous subprocess, returning the result
+        (a subprocess.CompletedProcess instance
+        with stderr and stdout combined as bytes in its stdout attribute).
+        The output is captured and logged after the process has finished,
+        so the output of concurrent processes is not interleaved.
+        """
+        command = [self.git_command, *arguments]
+        kwargs.update(
+            dict(stdout=subprocess.PIPE,
+                 stderr=subprocess.STDOUT))
+        kwargs.setdefault('env', self.env)
+        LOGGER.info(
+            '[Executing command] %s',
+            processwrappers.future_shlex_join(command))
+        process = await asyncio.create_subprocess_exec(*command, **kwargs)
+        stdout_data, _ = await process.communicate()
+        for output_line in as_text(stdout_data).splitlines():
+            LOGGER.info(output_line.rstrip())
+        #
+        return subprocess.CompletedProcess(
+            command, process.returncode, stdout=stdout_data)
+
+    async def gather_many(self, arguments_sequence, **kwargs):
+        """Coroutine running git once for each item
+        (a sequence of arguments) in arguments_sequence,
+        with at most MAX_CONCURRENT_PROCESSES processes at a time.
+        Return a list of the outputs in the same order.
+        """
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_PROCESSES)
+
+        async def limited_get_output(arguments):
+            """Wait for the semaphore before running git"""
+            async with semaphore:
+                return await self.get_output_async(*arguments, **kwargs)
             #
-            for stdout_line in stdout_text.splitlines():
-                logging.debug('[Command stdout] %s', stdout_line)
+
+        return await asyncio.gather(
+            *[limited_get_output(arguments)
+              for arguments in arguments_sequence])
+
+    def get_many_outputs(self, arguments_sequence, **kwargs):
+        """Run git once for each item in arguments_sequence
+        concurrently (see gather_many())
+        and return a list of the outputs in the same order.
+        """
+        return processwrappers.run_coroutine(
+            self.gather_many(arguments_sequence, **kwargs))
+
+    @staticmethod
+    def __log_output(output_text, log_output=True):
+        """Return the (combined) output text,
+        logging it line by line if log_output is True
+        (and debug messages are enabled at all)
+        """
+        if log_output and output_text and LOGGER.isEnabledFor(logging.DEBUG):
+            for output_line in output_text.splitlines():
+                LOGGER.debug('[Command output] %s', output_line)
             #
         #
-        if not stderr_text:
-            return stdout_text
-        #
-        if not stdout_text:
-            return stderr_text
+        return output_text
+
+    @staticmethod
+    def __log_stderr(stderr_text):
+        """Log the captured stderr_text line by line
+        (if debug messages are enabled at all)
+        """
+        if stderr_text and LOGGER.isEnabledFor(logging.DEBUG):
+            for stderr_line in stderr_text.splitlines():
+                LOGGER.debug('[Command stderr] %s', stderr_line)
+            #
         #
-        return '\n'.join((stderr_text, stdout_text))
 
     def get_returncode(self, *arguments, **kwargs):
         """Run git with the specified arguments
@@ -148,17 +388,124 @@ class BaseGitWrapper:
                  stderr=None,
                  loglevel=logging.INFO))
         kwargs.setdefault('env', self.env)
+        if sys.platform == 'win32':
+            # Keep the console for the non-captured output
+            kwargs.setdefault('creationflags', 0)
+        #
         command_result = get_command_result(
             self.git_command, *arguments, **kwargs)
         return command_result.returncode
 
 
+class GitCatFileBatchCheck(BaseGitWrapper):
+
+    """Persistent 'git cat-file --batch-check' session
+    for object name and type queries.
+    The git process is started on first use and kept running
+    until close() is called, so each query costs only a pipe
+    roundtrip instead of a new process.
+
+    Queries are serialized through a lock, so a single session
+    can be shared between threads.
+    """
+
+    missing_suffixes = (' missing', ' ambiguous')
+
+    def __init__(self,
+                 env=None,
+                 git_command=DEFAULT_GIT):
+        """Set the env and git_command attributes via the parent class,
+        plus the internal __process attribute.
+        """
+        super().__init__(env=env, git_command=git_command)
+        self.__process = None
+        self.__lock = threading.Lock()
+
+    def __enter__(self):
+        """Context manager entry"""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Context manager exit: close the session"""
+        self.close()
+
+    def __get_process(self):
+        """Return the running 'git cat-file --batch-check' process,
+        starting it if necessary
+        """
+        if self.__process is None:
+            command = [self.git_command, 'cat-file', '--batch-check']
+            LOGGER.debug(
+                '[Starting persistent command] %s',
+                processwrappers.future_shlex_join(command))
+            popen_kwargs = dict(processwrappers.SUBPROCESS_DEFAULTS)
+            # stderr is not captured because it is never read
+            popen_kwargs.update(
+                env=self.env,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=None)
+            self.__process = subprocess.Popen(command, **popen_kwargs)
+        #
+        return self.__process
+
+    def close(self):
+        """Terminate the git process if it is running"""
+        with self.__lock:
+            process = self.__process
+            if process is None:
+                return
+            #
+            self.__process = None
+        #
+        process.stdin.close()
+        process.wait()
+        process.stdout.close()
+
+    def get_object(self, name):
+        """Return an (object name, object type) tuple
+        for the object specified by name,
+        or None if no such object exists.
+        """
+        if '\n' in name:
+            raise ValueError('Invalid object name: %r!' % name)
+        #
+        with self.__lock:
+            process = self.__get_process()
+            process.stdin.write(name.encode() + b'\n')
+            process.stdin.flush()
+            header = process.stdout.readline().decode().rstrip('\n')
+            if not header:
+                exit_with_error(
+                    'The git cat-file --batch-check session'
+                    ' ended unexpectedly.')
+            #
+        #
+        if header.endswith(self.missing_suffixes):
+            return None
+        #
+        object_name, object_type, _ = header.split()
+        return (object_name, object_type)
+
+    def get_object_name(self, name):
+        """Return the full object name (i.e. the id)
+        of the object specified by name,
+        or None if no such object exists.
+        """
+        object_data = self.get_object(name)
+        if object_data is None:
+            return None
+        #
+        return object_data[0]
+
+
 class GitConfigWrapper(BaseGitWrapper):
 
     """Wrapper for a subset of possible git config calls:
     git config [ --global | --local ] <key> <value>
     git --get [ --global | --local ] <key>
     git --unset [ --global | --local ] <key>
+    git --list -z [ --global | --local ]
 
     The --global or --local option is passed via scope
     and always defaults to --local.
@@ -184,10 +531,16 @@ class GitConfigWrapper(BaseGitWrapper):
             raise ValueError('Invalid key for git config: %r!' % key)
         #
 
-    def __execute(self, *args, scope=CONFIG_LOCAL, **kwargs):
+    def __execute(self,
+                  *args,
+                  scope=CONFIG_LOCAL,
+                  stdout_only=False,
+                  **kwargs):
         """Execute the 'git config' command.
         If scope is set to None explicitly, the preferred scope
-        (--local) is omitted
+        (--local) is omitted.
+        If stdout_only is True, return standard output only
+        (for parsed values).
         """
         subcommand = ['config']
         if scope == CONFIG_GLOBAL or (
@@ -195,6 +548,9 @@ class GitConfigWrapper(BaseGitWrapper):
             subcommand.append(scope)
         #
         kwargs.setdefault('env', self.env)
+        if stdout_only:
+            return self.get_stdout(*subcommand, *args, **kwargs)
+        #
         return self.get_output(*subcommand, *args, **kwargs)
 
     def __call__(self, key, value, scope=CONFIG_LOCAL, **kwargs):
@@ -205,7 +561,25 @@ class GitConfigWrapper(BaseGitWrapper):
     def get(self, key, scope=CONFIG_LOCAL, **kwargs):
         """git config <scope> --get <key>"""
         self.__check_key(key)
-        return self.__execute('--get', key, scope=scope, **kwargs)
+        return self.__execute(
+            '--get', key, scope=scope, stdout_only=True, **kwargs)
+
+    def list_values(self, scope=CONFIG_LOCAL, **kwargs):
+        """git config <scope> --list -z
+        Return a dict of all keys and their values
+        (the last one wins for keys having multiple values)
+        """
+        output = self.__execute(
+            '--list', '-z', scope=scope, stdout_only=True, log_output=False,
+            **kwargs)
+        values = {}
+        for entry in output.split('\0'):
+            if entry:
+                key, _, value = entry.partition('\n')
+                values[key] = value
+            #
+        #
+        return values
 
     def unset(self, key, scope=CONFIG_LOCAL, **kwargs):
         """git config <scope> --unset <key>"""
@@ -216,8 +590,10 @@ class GitConfigWrapper(BaseGitWrapper):
 class GitWrapper(BaseGitWrapper):
 
     """Wrapper for a subset of possible git commands.
-    The .config instance attribute
-    is set to a GitConfigWrapper instance.
+    The .config property provides a GitConfigWrapper instance
+    (created on first access),
+    and the .cat_file_check instance attribute is set to
+    a GitCatFileBatchCheck instance.
     """
 
     def __init__(self,
@@ -225,18 +601,48 @@ class GitWrapper(BaseGitWrapper):
                  git_command=DEFAULT_GIT,
                  local_config_enabled=True):
         """Set the env and git_command attributes via the parent class,
-        plus the wrapper for 'git config'.
+        plus the settings for the 'git config' wrapper
+        and the wrapper for 'git cat-file --batch-check'.
         """
         super().__init__(env=env, git_command=git_command)
-        self.config = None
-        self.set_config(local_config_enabled=local_config_enabled)
+        self.__config = None
+        self.__local_config_enabled = local_config_enabled
+        self.cat_file_check = GitCatFileBatchCheck(
+            env=self.env,
+            git_command=self.git_command)
+
+    @property
+    def config(self):
+        """The wrapper for 'git config', created on first access"""
+        if self.__config is None:
+            self.__config = GitConfigWrapper(
+                env=self.env,
+                git_command=self.git_command,
+                local_config_enabled=self.__local_config_enabled)
+        #
+        return self.__config
+
+    def close(self):
+        """Close the persistent 'git cat-file --batch-check' session
+        (it is restarted automatically on next use)
+        """
+        self.cat_file_check.close()
 
     def set_config(self, local_config_enabled=True):
-        """Set the wrapper for 'git config'"""
-        self.config = GitConfigWrapper(
-            env=self.env,
-            git_command=self.git_command,
-            local_config_enabled=local_config_enabled)
+        """Set the wrapper for 'git config'
+        (to be re-created on next access)
+        """
+        self.__local_config_enabled = local_config_enabled
+        self.__config = None
+
+    def __get_read_only_output(self, *arguments, **kwargs):
+        """Return the standard output of a read-only git command,
+        started using READ_ONLY_SPAWN_OPTIONS
+        """
+        for key, value in READ_ONLY_SPAWN_OPTIONS.items():
+            kwargs.setdefault(key, value)
+        #
+        return self.get_stdout(*arguments, **kwargs)
 
     # Commands returning only the returncode
 
@@ -252,6 +658,20 @@ class GitWrapper(BaseGitWrapper):
         """
         return self.get_returncode('push', *arguments, **kwargs)
 
+    def push_streamed(self, *arguments, **kwargs):
+        """git push + arguments
+        Log output while running and return the result
+        (a subprocess.CompletedProcess instance)
+        """
+        return self.get_streamed_result('push', *arguments, **kwargs)
+
+    async def push_result_async(self, *arguments, **kwargs):
+        """Coroutine: git push + arguments
+        Capture and log output and return the result
+        (a subprocess.CompletedProcess instance, output in stdout)
+        """
+        return await self.get_result_async('push', *arguments, **kwargs)
+
     def showref_rc(self, *arguments, **kwargs):
         """git show-ref + arguments
         Passthru output and return returncode
@@ -260,15 +680,17 @@ class GitWrapper(BaseGitWrapper):
 
     def svn_fetch(self, *arguments, **kwargs):
         """git svn fetch + arguments
-        Passthru output and return returncode
+        Log output (not collecting it) and return returncode
         """
-        return self.get_returncode('svn', 'fetch', *arguments, **kwargs)
+        return self.get_streamed_returncode(
+            'svn', 'fetch', *arguments, **kwargs)
 
     def svn_init(self, *arguments, **kwargs):
         """git svn init + arguments
-        Passthru output and return returncode
+        Log output (not collecting it) and return returncode
         """
-        return self.get_returncode('svn', 'init', *arguments, **kwargs)
+        return self.get_streamed_returncode(
+            'svn', 'init', *arguments, **kwargs)
 
     # Commands returning output
 
@@ -284,11 +706,19 @@ class GitWrapper(BaseGitWrapper):
         """
         return self.get_output('checkout', *arguments, **kwargs)
 
+    def for_each_ref(self, *arguments, **kwargs):
+        """git for-each-ref + arguments
+        Return stdout (stderr is captured separately and only logged)
+        """
+        return self.__get_read_only_output(
+            'for-each-ref', *arguments, **kwargs)
+
     def log(self, *arguments, **kwargs):
         """git log + arguments
-        Capture stderr and stdout and return them combined
+        Return stdout (stderr is captured separately and only logged)
         """
-        return self.get_output('log', *arguments, **kwargs)
+        return self.__get_read_only_output(
+            'log', *arguments, **kwargs)
 
     def rebase(self, *arguments, **kwargs):
         """git rebase + arguments
@@ -298,9 +728,16 @@ class GitWrapper(BaseGitWrapper):
 
     def remote(self, *arguments, **kwargs):
         """git remote + arguments
-        Capture stderr and stdout and return them combined
+        Return stdout (stderr is captured separately and only logged)
         """
-        return self.get_output('remote', *arguments, **kwargs)
+        return self.get_stdout('remote', *arguments, **kwargs)
+
+    def rev_list(self, *arguments, **kwargs):
+        """git rev-list + arguments
+        Return stdout (stderr is captured separately and only logged)
+        """
+        return self.__get_read_only_output(
+            'rev-list', *arguments, **kwargs)
 
     def showref_output(self, *arguments, **kwargs):
         """git show-ref + arguments
@@ -310,9 +747,9 @@ class GitWrapper(BaseGitWrapper):
 
     def status(self, *arguments, **kwargs):
         """git status + arguments
-        Capture stderr and stdout and return them combined
+        Return stdout (stderr is captured separately and only logged)
         """
-        return self.get_output('status', *arguments, **kwargs)
+        return self.get_stdout('status', *arguments, **kwargs)
 
     def tag(self, *arguments, **kwargs):
         """git tag + arguments
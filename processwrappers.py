@@ -13,15 +13,16 @@ License: MIT, see LICENSE file
 """
 
 
+import asyncio
 import logging
-import re
+import os
+import selectors
 import shlex
 import subprocess
 import sys
 import threading
-import time
 
-from queue import Queue
+from queue import Empty, Queue
 
 
 #
@@ -29,6 +30,8 @@ from queue import Queue
 #
 
 
+LOGGER = logging.getLogger(__name__)
+
 SUBPROCESS_DEFAULTS = dict(
     close_fds=True,
     stderr=subprocess.PIPE,
@@ -36,8 +39,15 @@ SUBPROCESS_DEFAULTS = dict(
 
 if sys.platform == 'win32':
     del SUBPROCESS_DEFAULTS['close_fds']
+    # Do not open a console window for each captured command.
+    # subprocess.CREATE_NO_WINDOW is only defined since Python 3.7.
+    SUBPROCESS_DEFAULTS['creationflags'] = getattr(
+        subprocess, 'CREATE_NO_WINDOW', 0x08000000)
 #
 
+# Maximum number of bytes read from a pipe at once
+READ_CHUNK_SIZE = 65536
+
 
 #
 # Classes
@@ -46,15 +56,24 @@ if sys.platform == 'win32':
 
 class AsynchronousLineReader(threading.Thread):
     """Helper class to implement asynchronous
-    line-per-line reading of a stream in a separate thread.
+    line-per-line reading of a (binary) stream in a separate thread.
     Pushes read lines on a queue to be consumed in another thread.
 
+    If a tag is given, (tag, line) tuples are pushed instead,
+    and (tag, None) is pushed after the end of the stream,
+    so a queue can be shared between several readers
+    and consumed by blocking Queue.get() calls.
+
     Adapted from <https://github.com/soxofaan/asynchronousfilereader>
     """
 
-    def __init__(self, stream, autostart=True):
+    def __init__(self, stream, autostart=True, queue=None, tag=None):
         self._stream = stream
-        self.queue = Queue()
+        self._tag = tag
+        if queue is None:
+            queue = Queue()
+        #
+        self.queue = queue
         threading.Thread.__init__(self)
         if autostart:
             self.start()
@@ -62,14 +81,48 @@ class AsynchronousLineReader(threading.Thread):
 
     def run(self):
         """The body of the thread:
-        read lines and put them on the queue.
+        read chunks of up to READ_CHUNK_SIZE bytes,
+        split them into lines and put these on the queue.
+        Output ending in a carriage return (e.g. progress messages)
+        is put on the queue as well instead of waiting for a line feed.
+        os.read() blocks until data is available,
+        so no sleeping is required here.
         """
-        while True:
-            time.sleep(0)
-            line = self._stream.readline()
-            if not line:
-                break
+        file_descriptor = self._stream.fileno()
+        pending_data = b''
+        try:
+            while True:
+                chunk = os.read(file_descriptor, READ_CHUNK_SIZE)
+                if not chunk:
+                    if pending_data:
+                        self.__put(pending_data)
+                    #
+                    break
+                #
+                lines = (pending_data + chunk).split(b'\n')
+                # Keep an incomplete last line until more data arrives
+                pending_data = lines.pop()
+                for line in lines:
+                    self.__put(line + b'\n')
+                #
+                split_position = pending_data.rfind(b'\r') + 1
+                if split_position:
+                    self.__put(pending_data[:split_position])
+                    pending_data = pending_data[split_position:]
+                #
+            #
+        finally:
+            if self._tag is not None:
+                self.queue.put((self._tag, None))
+            #
+        #
+
+    def __put(self, line):
+        """Put the line on the queue (tagged if required)"""
+        if self._tag is None:
             self.queue.put(line)
+        else:
+            self.queue.put((self._tag, line))
         #
 
     def eof(self):
@@ -77,9 +130,16 @@ class AsynchronousLineReader(threading.Thread):
         return not self.is_alive() and self.queue.empty()
 
     def readlines(self):
-        """Get currently available lines."""
-        while not self.queue.empty():
-            yield self.queue.get()
+        """Get currently available lines
+        (using one get_nowait() call per line instead of
+        an additional empty() check, each acquiring the queue lock).
+        """
+        while True:
+            try:
+                yield self.queue.get_nowait()
+            except Empty:
+                return
+            #
         #
 
 
@@ -88,24 +148,50 @@ class AsynchronousLineReader(threading.Thread):
 #
 
 
-def future_shlex_join(sequence):
-    """Simple replacement for the shlex.join() function
-    (introduced in Python 3.8) if it is not available yet.
+if hasattr(shlex, 'join'):
+    future_shlex_join = shlex.join
+else:
+    def future_shlex_join(sequence):
+        """Simple replacement for the shlex.join() function
+        (introduced in Python 3.8) if it is not available yet.
+        """
+        return ' '.join(shlex.quote(item) for item in sequence)
+    #
+#
+
+
+def get_available_cpus():
+    """Return the number of CPUs this process may run on.
+    Use the CPU affinity mask where available (i.e. on Linux),
+    because os.cpu_count() returns the number of all CPUs of the host
+    even if the process is restricted to some of them
+    (e.g. in a container).
     """
     try:
-        return shlex.join(sequence)
+        return len(os.sched_getaffinity(0)) or 1
     except AttributeError:
-        pass
+        return os.cpu_count() or 1
     #
-    output_sequence = []
-    for item in sequence:
-        if re.search(r'\s', item):
-            output_sequence.append(repr(item))
-        else:
-            output_sequence.append(item)
-        #
+
+
+def run_coroutine(coroutine):
+    """Run the coroutine in a new event loop and return its result.
+    Replacement for asyncio.run() (introduced in Python 3.7),
+    using a ProactorEventLoop on Windows because that one is required
+    for subprocesses there before Python 3.8.
+    """
+    if sys.platform == 'win32':
+        loop = asyncio.ProactorEventLoop()
+    else:
+        loop = asyncio.new_event_loop()
+    #
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
     #
-    return ' '.join(output_sequence)
 
 
 def __prepare_command(command, **kwargs):
@@ -119,17 +205,22 @@ def __prepare_command(command, **kwargs):
           (defaults to logging.INFO)
     """
     if isinstance(command, str):
-        logging.warning(
+        LOGGER.warning(
             'Converting command %r given as a string into a list',
             command)
         converted_command = shlex.split(command)
     else:
-        # Convert all command components to strings
-        converted_command = [str(argument) for argument in command]
+        converted_command = list(command)
+        # Convert command components to strings only if required
+        for index, argument in enumerate(converted_command):
+            if not isinstance(argument, str):
+                converted_command[index] = str(argument)
+            #
+        #
     #
     loglevel = kwargs.pop('loglevel', None)
     if loglevel:
-        logging.log(
+        LOGGER.log(
             loglevel,
             '[Executing command] %s',
             future_shlex_join(converted_command))
@@ -183,11 +274,107 @@ def get_streams_and_process(command, **kwargs):
     return process_info
 
 
+def __drain_posix_pipes(process):
+    """Read the stderr and stdout pipes of process
+    in the current thread, using a selector,
+    and yield (stream_name, data) tuples until all pipes are closed.
+    data contains all complete lines read at once
+    (including lines ending in a carriage return).
+    """
+    pending_data = dict(stderr=b'', stdout=b'')
+    with selectors.DefaultSelector() as selector:
+        for stream_name in pending_data:
+            stream = getattr(process, stream_name)
+            if stream is not None:
+                selector.register(stream, selectors.EVENT_READ, stream_name)
+            #
+        #
+        while selector.get_map():
+            # Block until data or the end of a stream arrives
+            # (no periodic wakeups are required)
+            for (key, _) in selector.select():
+                stream_name = key.data
+                chunk = os.read(key.fd, READ_CHUNK_SIZE)
+                if not chunk:
+                    # End of stream
+                    selector.unregister(key.fileobj)
+                    if pending_data[stream_name]:
+                        yield (stream_name, pending_data[stream_name])
+                    #
+                    continue
+                #
+                data = pending_data[stream_name] + chunk
+                split_position = max(
+                    data.rfind(b'\n'), data.rfind(b'\r')) + 1
+                # Keep an incomplete last line until more data arrives
+                pending_data[stream_name] = data[split_position:]
+                if split_position:
+                    yield (stream_name, data[:split_position])
+                #
+            #
+        #
+    #
+
+
+def __drain_threaded_pipes(process):
+    """Read the stderr and stdout pipes of process using
+    one tagged AsynchronousLineReader thread per pipe
+    and yield (stream_name, line) tuples from their shared queue
+    until all readers have signalled the end of their stream.
+    """
+    output_queue = Queue()
+    readers = [
+        AsynchronousLineReader(
+            getattr(process, stream_name),
+            queue=output_queue,
+            tag=stream_name)
+        for stream_name in ('stderr', 'stdout')
+        if getattr(process, stream_name) is not None]
+    open_streams = len(readers)
+    while open_streams:
+        # Wait (blocking) for the next line
+        stream_name, line = output_queue.get()
+        if line is None:
+            open_streams -= 1
+            continue
+        #
+        yield (stream_name, line)
+    #
+    # Wait for the threads to end
+    for reader in readers:
+        reader.join()
+    #
+
+
+def drain_process(process):
+    """Yield (stream_name, data) tuples for the output
+    read from the stderr and stdout pipes of process
+    (a Popen instance) in the order it arrives,
+    until both pipes are closed.
+    A stream that is not captured (i.e. None) is skipped.
+    data is a bytes object containing one or more complete lines
+    including their line feeds or carriage returns (the latter
+    are used by progress messages; only the last data of a stream
+    may end with an incomplete line).
+
+    On POSIX systems, the pipes are read in the current thread
+    using a selector. On Windows (where selectors do not support pipes),
+    one AsynchronousLineReader thread per pipe is used.
+    """
+    if sys.platform == 'win32':
+        return __drain_threaded_pipes(process)
+    #
+    return __drain_posix_pipes(process)
+
+
 def long_running_process_result(command,
                                 check=True,
                                 stderr_loglevel=logging.ERROR,
                                 stdout_loglevel=logging.INFO,
                                 all_to_stdout=False,
+                                discard_stdout=False,
+                                passthru_stderr=False,
+                                echo_stderr=False,
                                 output_encoding='UTF-8',
                                 **kwargs):
     """Blueprint for handling long-running processes:
@@ -196,6 +383,18 @@ def long_running_process_result(command,
     Return a CompletedProcess instance or raise a CalledProcessError
     if check is True (the default) and the returncode is non-zero.
     If all_to_stdout ist set True, redirect stderr to stdout.
+    If discard_stdout is set True, stdout is logged but not collected
+    (the stdout attribute of the result will be None then).
+    If passthru_stderr is set True, stderr is not captured at all
+    but written directly to the parent's stderr (e.g. the terminal),
+    so prompts written there are visible immediately.
+    If echo_stderr is set True, stderr is collected, but written
+    unchanged to the parent's stderr instead of being logged,
+    so progress messages are displayed as on a terminal.
+    Output is collected as bytes and decoded (using output_encoding,
+    replacing undecodable bytes) for logging only.
+
+    Both pipes are read through drain_process().
 
     This function is not suitable for processes asking for user input
     because propts not ending in a line break will not be presented
@@ -204,46 +403,71 @@ def long_running_process_result(command,
     Also adapted from
     <https://github.com/soxofaan/asynchronousfilereader>
     """
-    kwargs['stderr'] = AsynchronousLineReader
-    kwargs['stdout'] = AsynchronousLineReader
-    if sys.platform != 'win32':
-        kwargs['close_fds'] = True
+    if discard_stdout:
+        collected_stdout = None
+    else:
+        collected_stdout = bytearray()
     #
-    process_info = get_streams_and_process(command, **kwargs)
-    process = process_info['process']
-    stdout_reader = process_info['stdout']
-    stderr_reader = process_info['stderr']
-    collected_stdout = []
-    if all_to_stdout:
+    if passthru_stderr:
+        collected_stderr = None
+    elif all_to_stdout:
         collected_stderr = collected_stdout
     else:
-        collected_stderr = []
+        collected_stderr = bytearray()
+    #
+    collectors = dict(stderr=collected_stderr, stdout=collected_stdout)
+    loglevels = dict(stderr=stderr_loglevel, stdout=stdout_loglevel)
+    # Determine once which streams are logged at all
+    # (and skip decoding output that would not be logged anyway)
+    logged_streams = {
+        stream_name for (stream_name, loglevel) in loglevels.items()
+        if LOGGER.isEnabledFor(loglevel)}
+
+    if passthru_stderr:
+        kwargs['stderr'] = None
+    else:
+        kwargs['stderr'] = subprocess.PIPE
     #
-    while not stdout_reader.eof() or not stderr_reader.eof():
-        # Show what has been received from stderr and stdout,
-        # then sleep a short time before polling again
-        for line in stderr_reader.readlines():
-            collected_stderr.append(line)
-            logging.log(
-                stderr_loglevel, line.decode(output_encoding).rstrip())
+    kwargs['stdout'] = subprocess.PIPE
+    if sys.platform != 'win32':
+        kwargs['close_fds'] = True
+    #
+    process = get_streams_and_process(command, **kwargs)['process']
+    for (stream_name, data) in drain_process(process):
+        if collectors[stream_name] is not None:
+            collectors[stream_name].extend(data)
+        #
+        if echo_stderr and stream_name == 'stderr':
+            sys.stderr.buffer.write(data)
+            sys.stderr.buffer.flush()
+            continue
         #
-        for line in stdout_reader.readlines():
-            collected_stdout.append(line)
-            logging.log(
-                stdout_loglevel, line.decode(output_encoding).rstrip())
-        time.sleep(.1)
-    # Cleanup:
-    # Wait for the threads to end and close the file descriptors
-    stderr_reader.join()
-    stdout_reader.join()
-    process.stderr.close()
+        if stream_name not in logged_streams:
+            continue
+        #
+        # Decode all lines read at once in one go,
+        # but log each line as a record of its own
+        # (so each line is formatted with the log level prefix)
+        for line in data.decode(
+                output_encoding, errors='replace').splitlines():
+            LOGGER.log(loglevels[stream_name], line.rstrip())
+        #
+    #
+    # Cleanup: close the file descriptors
+    if process.stderr is not None:
+        process.stderr.close()
+    #
     process.stdout.close()
     # Construct and return the result
-    stdout_data = b''.join(collected_stdout)
-    if all_to_stdout:
+    if discard_stdout:
+        stdout_data = None
+    else:
+        stdout_data = bytes(collected_stdout)
+    #
+    if all_to_stdout or passthru_stderr:
         stderr_data = None
     else:
-        stderr_data = b''.join(collected_stderr)
+        stderr_data = bytes(collected_stderr)
     #
     completed_process = subprocess.CompletedProcess(
         args=process.args,
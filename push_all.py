@@ -16,14 +16,22 @@ License: MIT, see LICENSE file
 
 
 import argparse
+import asyncio
+import concurrent.futures
 import datetime
+import functools
 import logging
 import os
+import random
+import re
 import sys
+import threading
+import time
 
 # local module
 
 import gitwrapper
+import processwrappers
 
 
 #
@@ -31,24 +39,65 @@ import gitwrapper
 #
 
 
+LOGGER = logging.getLogger(__name__)
+
 MESSAGE_FORMAT_PURE = '%(message)s'
 MESSAGE_FORMAT_WITH_LEVELNAME = '%(levelname)-8s\u2551 %(message)s'
 
 RETURNCODE_OK = 0
 RETURNCODE_ERROR = 1
 
-ENV = dict(os.environ)
-ENV['LANG'] = 'C'       # Prevent command output translation
+# Returncode of 'git remote get-url' if the remote does not exist
+RETURNCODE_NO_SUCH_REMOTE = 2
+
+# Environment variable set to 'C' to prevent command output translation
+ENV_LANG = 'LANG'
 
 ORIGIN = 'origin'
 
+# Ref name prefixes of local branches and tags
+REFS_HEADS_PREFIX = 'refs/heads/'
+REFS_TAGS_PREFIX = 'refs/tags/'
+
 # Git executable
 GIT = 'git'
 
 # Defaults
-DEFAULT_BRANCH_NAMES = ('main', 'master', 'trunk', 'development')
+DEFAULT_BRANCH_NAMES = frozenset(('main', 'master', 'trunk', 'development'))
 DEFAULT_MAX_BATCH_SIZE = 1024
 
+# Maximum number of tags pushed with a single git push command
+# (further limited by the maximum batch size)
+TAG_PUSH_CHUNK_SIZE = 64
+
+# Retries of failed pushes: default number of tries,
+# base and maximum delay in seconds
+DEFAULT_PUSH_TRIES = 4
+PUSH_RETRY_BASE_DELAY = 1.0
+PUSH_RETRY_MAX_DELAY = 30.0
+
+# Push errors that will not go away by retrying
+# (smaller batches might help instead)
+PRX_STRUCTURAL_PUSH_ERROR = re.compile(
+    rb'pack exceeds maximum allowed size|hook declined'
+    rb'|\[(?:remote )?rejected\]')
+
+# Push errors caused by (probably) temporary network or server problems.
+# HTTP 4xx errors other than 429 (e.g. missing permissions)
+# and certificate errors are not retried.
+PRX_TRANSIENT_PUSH_ERROR = re.compile(
+    rb'could not resolve host|connection timed out|connection reset'
+    rb'|the requested url returned error: (?:429|5\d\d)'
+    rb'|rpc failed; (?:http (?:429|5\d\d)|curl (?!22\b)\d+)',
+    re.IGNORECASE)
+
+# Default number of concurrent branch resp. tag pushes
+DEFAULT_JOBS = max(1, processwrappers.get_available_cpus() * 3 // 4)
+
+# git log format of the commit log entries for failed commits
+COMMIT_LOG_FORMAT = \
+    'format:Commit %H%nAuthor: %an <%ae>%nDate:   %ci%n%s'
+
 NO_CAUSE = 'no cause given'
 NO_REASON = 'no reason given'
 
@@ -56,11 +105,9 @@ SEPARATOR_LINE = '-' * 72
 
 SCRIPT_NAME = os.path.basename(__file__)
 
-# Read the (script) version from version.txt
-with open(os.path.join(os.path.dirname(sys.argv[0]), 'version.txt'),
-          mode='rt') as version_file:
-    VERSION = version_file.read().strip()
-#
+# File containing the (script) version, next to this file
+VERSION_FILE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'version.txt')
 
 
 #
@@ -76,7 +123,8 @@ class DataContainer:
         """Initialize container components"""
         self.names = list(names_sequence)
         self.failed_pushes = {}
-        self.successful_pushes = []
+        # dict used as an insertion-ordered set (values are None)
+        self.successful_pushes = {}
         self.skipped_pushes = {}
         self.term = term
 
@@ -105,7 +153,7 @@ class DataContainer:
         """Set all items to 'successful'"""
         self.failed_pushes.clear()
         self.skipped_pushes.clear()
-        self.successful_pushes = list(self.names)
+        self.successful_pushes = dict.fromkeys(self.names)
 
     def skip_remaining(self, reason=NO_REASON):
         """Set all items neither successful nor failed
@@ -123,31 +171,31 @@ class DataContainer:
         number_skipped = self.number_total \
             - self.number_successful \
             - self.number_failed
-        logging.info('---- %s summary ----', self.term.title())
-        logging.info(
+        LOGGER.info('---- %s summary ----', self.term.title())
+        LOGGER.info(
             '%s of %s %s pushed successfully (or already up to date)',
             self.number_successful, self.number_total, self.term)
         if self.number_failed:
-            logging.info('%s %s failed', self.number_failed, self.term)
+            LOGGER.info('%s %s failed', self.number_failed, self.term)
         #
         if number_skipped:
-            logging.info('%s %s skipped', number_skipped, self.term)
+            LOGGER.info('%s %s skipped', number_skipped, self.term)
         #
         for item in self.names:
             try:
                 cause = self.failed_pushes[item]
             except KeyError:
                 if item in self.successful_pushes:
-                    logging.info(
+                    LOGGER.info(
                         ' + %r push successful (or remote already up to date)',
                         item)
                 else:
                     reason = self.skipped_pushes.get(item, NO_REASON)
-                    logging.info(' - %r push skipped (%s)', item, reason)
+                    LOGGER.info(' - %r push skipped (%s)', item, reason)
                 #
                 continue
             #
-            logging.error(' - %r push failed (%s)', item, cause)
+            LOGGER.error(' - %r push failed (%s)', item, cause)
         #
 
 
@@ -158,28 +206,24 @@ class BranchesDataContainer(DataContainer):
     def __init__(self, names_sequence):
         """Initiailze the container,
         but put default branches in front
+        (keeping the order otherwise)
         """
-        default_branches = []
-        remaining_branches = []
-        for name in names_sequence:
-            if name in DEFAULT_BRANCH_NAMES:
-                default_branches.append(name)
-            else:
-                remaining_branches.append(name)
-            #
-        #
-        super().__init__(default_branches + remaining_branches,
-                         term='branches')
+        all_names = list(names_sequence)
+        super().__init__(
+            [name for name in all_names if name in DEFAULT_BRANCH_NAMES]
+            + [name for name in all_names
+               if name not in DEFAULT_BRANCH_NAMES],
+            term='branches')
 
     def show_enhanced_statistics(self, failed_commit_logs):
         """Show statistics enhanced with failed commit logs"""
         if failed_commit_logs:
-            logging.error('---- Commits that failed to be pushed ----')
+            LOGGER.error('---- Commits that failed to be pushed ----')
             for log_entry in failed_commit_logs:
                 for line in log_entry.splitlines():
-                    logging.error(line)
+                    LOGGER.error(line)
                 #
-                logging.error(SEPARATOR_LINE)
+                LOGGER.error(SEPARATOR_LINE)
             #
         #
         super().show_statistics()
@@ -199,21 +243,27 @@ class FullPush:
     def __init__(self, arguments):
         """Store the given options internally"""
         self.options = arguments
-        self.git = gitwrapper.GitWrapper(env=ENV, git_command=GIT)
-        self.branches = BranchesDataContainer(self.find_branches())
-        self.tags = DataContainer(self.get_tag_names(), term='tags')
+        self.git = gitwrapper.GitWrapper(env=None, git_command=GIT)
+        branch_names, tag_names, self.remote_refs = self.load_refs()
+        self.branches = BranchesDataContainer(branch_names)
+        self.tags = DataContainer(tag_names, term='tags')
         self.failed_commits = []
         self.batch_pushes_failed = {}
+        self.good_batch_sizes = {}
+        self.commit_logs = {}
+        # Guards the data shared between concurrent branch pushes
+        self.lock = threading.Lock()
+        self.__failed_commit_logs = []
 
     def run(self):
         """Do a full push"""
         start_time = datetime.datetime.now()
-        logging.info(
+        LOGGER.info(
             '%s %s started at %s',
             SCRIPT_NAME,
-            VERSION,
+            get_version(),
             start_time)
-        logging.info(SEPARATOR_LINE)
+        LOGGER.info(SEPARATOR_LINE)
         #
         # 1. Check for the origin or set it if required
         try:
@@ -241,19 +291,17 @@ class FullPush:
                 #
             #
             # 2a.2 Push branches
-            original_branch = self.get_current_branch()
             branch_result = self.push_branches()
-            self.git.checkout(original_branch)
             if branch_result:
-                logging.error(SEPARATOR_LINE)
+                LOGGER.error(SEPARATOR_LINE)
                 if not self.branches.successful_pushes:
                     gitwrapper.exit_with_error('All branch pushes failed!')
                 #
                 if self.options.fail_fast:
-                    logging.error('Not all branches could be pushed.')
+                    LOGGER.error('Not all branches could be pushed.')
                     self.branches.show_enhanced_statistics(
                         self.failed_commit_logs)
-                    logging.error(SEPARATOR_LINE)
+                    LOGGER.error(SEPARATOR_LINE)
                     gitwrapper.exit_with_error(
                         'Run this script again without the'
                         '--fail-fast option\n'
@@ -268,49 +316,72 @@ class FullPush:
             final_result = self.push_everything_globally()
         #
         # 3. Output results
-        logging.info(SEPARATOR_LINE)
+        LOGGER.info(SEPARATOR_LINE)
 
         self.branches.show_enhanced_statistics(self.failed_commit_logs)
         self.tags.show_statistics()
         #
-        logging.info(SEPARATOR_LINE)
+        LOGGER.info(SEPARATOR_LINE)
         finish_time = datetime.datetime.now()
-        logging.info(
+        LOGGER.info(
             '%s %s finished at %s',
             SCRIPT_NAME,
-            VERSION,
+            get_version(),
             finish_time)
         duration = (finish_time - start_time).total_seconds()
-        logging.info('Elapsed time: %d seconds', duration)
+        LOGGER.info('Elapsed time: %d seconds', duration)
         return final_result
 
     @property
     def failed_commit_logs(self):
-        """Return a list of logs (of all commits failed to be pushed)"""
-        return [self.get_commit_log(commit_id) for commit_id
-                in self.failed_commits]
-
-    def get_remote_url(self):
-        """Get the remote URL either from the preconfigured remote
-        or from the --set-origin option
+        """Return a list of logs (of all commits failed to be pushed).
+        The list is memoized and only extended by the logs
+        of commits added to self.failed_commits since the last access.
         """
-        configured_push_urls = {}
+        new_failed_commits = \
+            self.failed_commits[len(self.__failed_commit_logs):]
+        self.load_commit_logs(new_failed_commits)
+        self.__failed_commit_logs.extend(
+            self.get_commit_log(commit_id) for commit_id
+            in new_failed_commits)
+        return list(self.__failed_commit_logs)
+
+    def get_configured_push_url(self):
+        """Return the push URL configured for origin, or None.
+        Use 'git remote get-url --push' and fall back to
+        parsing 'git remote --verbose' output
+        for git versions not supporting that subcommand yet.
+        """
+        get_url_result = self.git.get_result(
+            'remote', 'get-url', '--push', ORIGIN)
+        if get_url_result.returncode == RETURNCODE_OK:
+            return get_url_result.stdout.strip() or None
+        #
+        if get_url_result.returncode == RETURNCODE_NO_SUCH_REMOTE:
+            # No origin configured, no need for the fallback
+            return None
+        #
+        # Lines look like 'origin<TAB>URL (push)',
+        # so only the matching line needs to be examined
+        line_prefix = f'{ORIGIN}\t'
+        line_suffix = ' (push)'
         for line in self.git.remote('--verbose',
                                     exit_on_error=False).splitlines():
-            try:
-                remote_name, url, scope = line.split()
-            except ValueError:
-                continue
-            #
-            if scope == '(push)':
-                configured_push_urls[remote_name] = url
+            if line.startswith(line_prefix) and line.endswith(line_suffix):
+                return line[len(line_prefix):-len(line_suffix)].strip()
             #
         #
+        return None
+
+    def get_remote_url(self):
+        """Get the remote URL either from the preconfigured remote
+        or from the --set-origin option
+        """
         specified_url = self.options.set_origin
-        origin_url = configured_push_urls.get(ORIGIN)
+        origin_url = self.get_configured_push_url()
         if specified_url and origin_url:
             if origin_url == specified_url:
-                logging.info('Using preconfigured URL %s', origin_url)
+                LOGGER.info('Using preconfigured URL %s', origin_url)
                 return origin_url
             #
             raise ValueError(
@@ -321,30 +392,18 @@ class FullPush:
                 'Otherwise, remove the existing remote and try again.')
         #
         if specified_url:
-            logging.info('Configuring URL %s for %s', specified_url, ORIGIN)
+            LOGGER.info('Configuring URL %s for %s', specified_url, ORIGIN)
             self.git.remote('add', ORIGIN, specified_url)
             return specified_url
         #
         if origin_url:
-            logging.info('Using preconfigured URL %s', origin_url)
+            LOGGER.info('Using preconfigured URL %s', origin_url)
             return origin_url
         #
         raise ValueError(
             f'No remote URL for {ORIGIN} preconfigured and none specified.\n'
             'Please specify a remote URL with --set-origin!')
 
-    def find_branches(self):
-        """Yield local branches,
-        taking care to ignore console color codes and ignoring the
-        '*' character used to indicate the currently selected branch.
-        """
-        for branch in self.git.branch('--list', '--no-color').splitlines():
-            branch = branch.replace('*', '').strip()
-            if branch:
-                yield branch
-            #
-        #
-
     def get_commit_log(self, commit_id):
         """Return a formatted commit log entry in a form like:
 
@@ -355,44 +414,88 @@ class FullPush:
 
         (to be printed for each commit on which a push of a branch
          eventually failed)
+
+        Log entries are cached per commit id.
         """
-        return self.git.log(
-            '-n', '1',
-            '--pretty=format:Commit %H%n'
-            'Author: %an <%ae>%nDate:   %ci%n%s',
-            commit_id)
-
-    def get_commit_id_before_head(self, offset=0):
-        """Return the id (hash) of the commit
-        that was offset (a positive number) commits before HEAD
+        try:
+            return self.commit_logs[commit_id]
+        except KeyError:
+            pass
+        #
+        commit_log = self.git.log(
+            '-n', '1', f'--pretty={COMMIT_LOG_FORMAT}', commit_id)
+        self.commit_logs[commit_id] = commit_log
+        return commit_log
+
+    def load_commit_logs(self, commit_ids):
+        """Load the log entries of all given commits
+        that are not cached yet, using a single git log call,
+        into the cache used by get_commit_log()
         """
-        if not isinstance(offset, int) or offset < 0:
-            raise ValueError('Offset must be a non-negative integer!')
+        missing_commit_ids = [
+            commit_id for commit_id in commit_ids
+            if commit_id not in self.commit_logs]
+        if not missing_commit_ids:
+            return
+        #
+        # -z separates the entries by NUL characters,
+        # --no-walk=unsorted keeps them in the given order
+        log_output = self.git.log(
+            '-z', '--no-walk=unsorted', f'--pretty={COMMIT_LOG_FORMAT}',
+            *missing_commit_ids,
+            log_output=False)
+        for commit_id, commit_log in zip(
+                missing_commit_ids, log_output.split('\0')):
+            self.commit_logs[commit_id] = commit_log
         #
-        arguments = ['-n', '1', '--first-parent', '--pretty=format:%H']
-        if offset:
-            arguments.append(f'--skip={offset}')
-        return self.git.log(*arguments)
 
-    def get_current_branch(self):
-        """Drop-in replacement for 'git branch --show-current'
-        for old git versions
+    def get_remote_refs(self):
+        """Return a set of all remote-tracking ref names
+        for origin, determined by a single git call
+        """
+        return set(
+            self.git.for_each_ref(
+                '--format=%(refname)',
+                f'refs/remotes/{ORIGIN}/',
+                log_output=False).splitlines())
+
+    def load_refs(self):
+        """Read the local branches, the tags and the remote-tracking
+        refs for origin using a single git for-each-ref call.
+        The refs/heads/ and refs/tags/ prefixes are stripped
+        explicitly instead of using %(refname:short),
+        which would prefix ambiguous names.
+
+        Return a (branch names list, tag names list,
+        remote-tracking ref names set) tuple
         """
-        for branch in self.git.branch('--list', '--no-color').splitlines():
-            branch = branch.strip()
-            if branch.startswith('*'):
-                return branch.replace('*', '').strip()
+        branch_names = []
+        tag_names = []
+        remote_refs = set()
+        for ref_name in self.git.for_each_ref(
+                '--format=%(refname)',
+                REFS_HEADS_PREFIX,
+                REFS_TAGS_PREFIX,
+                f'refs/remotes/{ORIGIN}/',
+                log_output=False).splitlines():
+            if ref_name.startswith(REFS_HEADS_PREFIX):
+                branch_names.append(ref_name[len(REFS_HEADS_PREFIX):])
+            elif ref_name.startswith(REFS_TAGS_PREFIX):
+                tag_names.append(ref_name[len(REFS_TAGS_PREFIX):])
+            elif ref_name:
+                remote_refs.add(ref_name)
             #
         #
-        raise ValueError('No current branch found')
-
-    def get_tag_names(self):
-        """Return a list of tag names"""
-        return self.git.tag('--list').splitlines()
+        return (branch_names, tag_names, remote_refs)
 
     def push_branches(self):
-        """Push all branches,
-        one by one in batches of maximum batch size.
+        """Push all branches in batches of maximum batch size.
+        The default branches are pushed first, one after another,
+        because the other branches are usually based on them.
+        The remaining branches are pushed concurrently
+        by up to self.options.jobs workers.
+        In fail-fast mode, branch pushes that have not been started yet
+        are cancelled after the first failure.
 
         Return RETURNCODE_OK if everything went fine,
         or RETURNCODE_ERROR on any errors
@@ -401,18 +504,119 @@ class FullPush:
             raise ValueError(
                 'Wrong method, use push_everything_globally()!')
         #
+        if self.push_branches_at_once() == RETURNCODE_OK:
+            return RETURNCODE_OK
+        #
+        default_branches = [
+            branch_name for branch_name in self.branches.names
+            if branch_name in DEFAULT_BRANCH_NAMES]
         highest_returncode = RETURNCODE_OK
-        for current_branch in self.branches.names:
-            push_returncode = self.push_single_branch(
-                current_branch)
-            if push_returncode and self.options.fail_fast:
+        for branch_name in default_branches:
+            highest_returncode = max(
+                self.push_branch(branch_name), highest_returncode)
+            if highest_returncode and self.options.fail_fast:
                 self.branches.skip_remaining(reason='previous_errors')
-                return push_returncode
+                return highest_returncode
+            #
+        #
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.options.jobs) as executor:
+            futures = [
+                executor.submit(self.push_branch, branch_name)
+                for branch_name in self.branches.names
+                if branch_name not in DEFAULT_BRANCH_NAMES]
+            for future in concurrent.futures.as_completed(futures):
+                if future.cancelled():
+                    continue
+                #
+                highest_returncode = max(future.result(), highest_returncode)
+                if highest_returncode and self.options.fail_fast:
+                    for pending_future in futures:
+                        pending_future.cancel()
+                    #
+                #
             #
-            highest_returncode = max(push_returncode, highest_returncode)
+        #
+        if highest_returncode and self.options.fail_fast:
+            self.branches.skip_remaining(reason='previous_errors')
         #
         return highest_returncode
 
+    def push_branches_at_once(self):
+        """If all commits missing on origin fit into a single batch,
+        try to push all branches using a single git push command,
+        negotiating with the remote only once.
+
+        Return RETURNCODE_OK if that succeeded,
+        or RETURNCODE_ERROR if the branches have to be pushed
+        one by one (i.e. if the push failed or was not attempted)
+        """
+        if not self.branches.names:
+            return RETURNCODE_ERROR
+        #
+        number_to_push = int(
+            self.git.rev_list(
+                '--count', '--branches', '--not', f'--remotes={ORIGIN}',
+                log_output=False).strip())
+        if not 0 < number_to_push <= self.options.maximum_batch_size:
+            return RETURNCODE_ERROR
+        #
+        LOGGER.info(
+            'Trying to push all %s branches (%s commits) at once…',
+            self.branches.number_total,
+            number_to_push)
+        # --atomic: either all branches are updated on origin or none,
+        # so the ranges determined for the fallback stay valid.
+        # A single glob refspec keeps the command line short
+        # regardless of the number of branches.
+        push_returncode = self.push_with_backoff(
+            '--atomic', f'{REFS_HEADS_PREFIX}*:{REFS_HEADS_PREFIX}*')
+        if push_returncode:
+            LOGGER.info('Failed, pushing branches one by one.')
+            return RETURNCODE_ERROR
+        #
+        LOGGER.info('OK')
+        self.branches.set_all_successful()
+        return RETURNCODE_OK
+
+    def push_with_backoff(self, *arguments, show_progress=False):
+        """Push to origin using the given arguments.
+        Retry pushes that failed due to transient errors
+        up to self.options.batch_backoff_tries times in total,
+        with exponential backoff and random jitter.
+        Other errors (e.g. an exceeded pack size) are not retried
+        because they require smaller batches instead.
+        If show_progress is True and stderr is a terminal,
+        git's progress messages are passed through to it.
+
+        Return the returncode of the last push
+        """
+        push_options = []
+        stream_options = {}
+        if show_progress and sys.stderr.isatty():
+            # git only shows progress if its stderr is a terminal,
+            # but it is a pipe here
+            push_options.append('--progress')
+            stream_options['echo_stderr'] = True
+        #
+        for attempt in range(self.options.batch_backoff_tries):
+            if attempt:
+                delay = get_retry_delay(attempt)
+                LOGGER.info('Retrying in %.1f seconds…', delay)
+                time.sleep(delay)
+            #
+            push_result = self.git.push_streamed(
+                *push_options, ORIGIN, *arguments, **stream_options)
+            if not push_result.returncode:
+                break
+            #
+            if not is_transient_push_error(push_result.stderr):
+                LOGGER.info('Push error is not transient, not retrying.')
+                break
+            #
+        #
+        return push_result.returncode
+
     def push_everything_globally(self):
         """Push branches and tags incrementally.
 
@@ -423,15 +627,15 @@ class FullPush:
             raise ValueError(
                 'Wrong method, use push_branches() and push_tags()!')
         #
-        branches_returncode = self.git.push(
-            '-u', ORIGIN, '--all', exit_on_error=False)
+        branches_returncode = self.push_with_backoff(
+            '-u', '--all', show_progress=True)
         if branches_returncode:
             self.branches.set_all_failed(cause='global push failed')
             return branches_returncode
         #
         self.branches.set_all_successful()
-        tags_returncode = self.git.push(
-            '-u', ORIGIN, '--tags', exit_on_error=False)
+        tags_returncode = self.push_with_backoff(
+            '-u', '--tags', show_progress=True)
         if tags_returncode:
             self.tags.set_all_failed()
         else:
@@ -439,8 +643,9 @@ class FullPush:
         #
         return tags_returncode
 
-    def push_incrementally(self, branch_name, number_to_push):
-        """Push number_to_push commits incrementally,
+    def push_incrementally(self, branch_name, commit_ids):
+        """Push the commits from commit_ids (a list of
+        first-parent commit ids, starting at HEAD) incrementally,
         in batches of up to self.options.maximum_batch_size commits.
         Try committing maximum_batch_size commits first,
         but half the batch size on each failure.
@@ -449,7 +654,8 @@ class FullPush:
 
         Adapted from <https://stackoverflow.com/a/51468389>.
         """
-        logging.info(
+        number_to_push = len(commit_ids)
+        LOGGER.info(
             '%s commits to be pushed in %r',
             number_to_push,
             branch_name)
@@ -459,24 +665,36 @@ class FullPush:
         pushed_commits = 0
         failed_constellations = []
         while last_offset:
+            if self.options.fail_fast and self.has_failed_branches():
+                # Stop between batches (a running push is not aborted)
+                LOGGER.info(
+                    'Stopping the push of %r because another branch'
+                    ' failed.', branch_name)
+                return RETURNCODE_OK
+            #
             if batch_size > last_offset:
                 batch_size = last_offset
             #
-            commit_id = self.get_commit_id_before_head(
-                offset=last_offset - batch_size)
-            logging.info(
-                'Trying to push %s commits (up to %s)…',
-                batch_size, commit_id)
+            # The commit that is (last_offset - batch_size) commits
+            # before HEAD
+            commit_id = commit_ids[last_offset - batch_size]
+            if LOGGER.isEnabledFor(logging.INFO):
+                LOGGER.info(
+                    'Trying to push %s commits of %r (up to %s)…',
+                    batch_size, branch_name, commit_id)
+            #
             # Check batch_pushes_failed first
             try:
-                failed_commit_id = self.batch_pushes_failed[(batch_size,
-                                                             commit_id)]
+                with self.lock:
+                    failed_commit_id = self.batch_pushes_failed[
+                        (batch_size, commit_id)]
+                #
             except KeyError:
-                push_returncode = self.git.push(
-                    ORIGIN, f'{commit_id}:refs/heads/{branch_name}',
-                    exit_on_error=False)
+                push_returncode = self.push_with_backoff(
+                    f'{commit_id}:refs/heads/{branch_name}')
             else:
-                logging.error('Same constellation failed before.')
+                LOGGER.error(
+                    'Same constellation of %r failed before.', branch_name)
                 # enforce skipping the branch
                 push_returncode = RETURNCODE_ERROR
                 commit_id = failed_commit_id
@@ -485,34 +703,46 @@ class FullPush:
             if push_returncode:
                 if batch_size > 1:
                     failed_constellations.append((batch_size, commit_id))
-                    logging.info('Failed, reducing batch size.')
+                    LOGGER.info(
+                        'Failed, reducing batch size for %r.', branch_name)
                     batch_size = batch_size // 2
                     continue
                 #
                 failed_constellations.append((batch_size, commit_id))
-                self.batch_pushes_failed.update(
-                    dict.fromkeys(failed_constellations, commit_id))
                 remaining_commits = last_offset
-                self.branches.failed_pushes[branch_name] = \
-                    'at %s, %s commits remain' % (
-                        commit_id, remaining_commits)
-                if commit_id not in self.failed_commits:
-                    self.failed_commits.append(commit_id)
+                with self.lock:
+                    self.batch_pushes_failed.update(
+                        dict.fromkeys(failed_constellations, commit_id))
+                    self.branches.failed_pushes[branch_name] = \
+                        'at %s, %s commits remain' % (
+                            commit_id, remaining_commits)
+                    if commit_id not in self.failed_commits:
+                        self.failed_commits.append(commit_id)
+                    #
                 #
-                logging.error(
+                LOGGER.error(
                     'Pushing branch %r failed at commit %s',
                     branch_name,
                     commit_id)
-                logging.error(
+                LOGGER.error(
                     '(%s of %s commits pushed successfully, %s remain)',
                     pushed_commits, number_to_push, remaining_commits)
                 return push_returncode
             #
             last_offset = last_offset - batch_size
             pushed_commits += batch_size
-            logging.info('OK')
-            # Double batch size (up to maximum)
-            new_batch_size = batch_size * 2
+            if LOGGER.isEnabledFor(logging.INFO):
+                LOGGER.info('OK (%r)', branch_name)
+            #
+            # Remember the highest batch size that worked for this branch
+            with self.lock:
+                good_batch_size = max(
+                    batch_size, self.good_batch_sizes.get(branch_name, 0))
+                self.good_batch_sizes[branch_name] = good_batch_size
+            #
+            # Double batch size (up to maximum),
+            # but return to the highest known good batch size directly
+            new_batch_size = max(batch_size * 2, good_batch_size)
             if new_batch_size > self.options.maximum_batch_size:
                 new_batch_size = self.options.maximum_batch_size
             #
@@ -520,52 +750,148 @@ class FullPush:
                 new_batch_size = last_offset
             #
             if new_batch_size > batch_size:
-                logging.info('Increasing batch size again.')
+                LOGGER.info(
+                    'Increasing batch size for %r again.', branch_name)
                 batch_size = new_batch_size
             #
         #
-        logging.info('Pushed branch %r:', branch_name)
-        logging.info(
-            '%s commits have been pushed successfully', pushed_commits)
+        LOGGER.info(
+            'Pushed branch %r: %s commits have been pushed successfully',
+            branch_name, pushed_commits)
         if pushed_commits != number_to_push:
-            logging.error('… but %s should have been pushed!', number_to_push)
+            LOGGER.error('… but %s should have been pushed!', number_to_push)
+        #
+        with self.lock:
+            self.branches.successful_pushes[branch_name] = None
         #
-        self.branches.successful_pushes.append(branch_name)
         return push_returncode
 
-    def push_single_branch(self, branch_name):
-        """Push commits of a single branch, if necessary."""
-        logging.info('Switching to branch %r', branch_name)
-        self.git.checkout(branch_name)
-        remote_branch = f'{ORIGIN}/{branch_name}'
-        if self.git.showref_rc(
-                '--quiet', '--verify', f'refs/remotes/{remote_branch}',
-                exit_on_error=False) > RETURNCODE_OK:
-            logging.info(
-                'Branch does not exist yet on origin, pushing all commits…')
-            commits_range = 'HEAD'
+    def push_branch(self, branch_name):
+        """Determine the (first-parent) commits of the branch
+        that are missing on origin, right before pushing them.
+        For a branch that already exists on origin, these are
+        the commits after the remote-tracking branch.
+        For a new branch, commits already pushed through
+        any other branch are left out.
+        The branch is not checked out (the commits are pushed using
+        <commit id>:refs/heads/<branch name> refspecs),
+        so multiple branches can be pushed concurrently.
+        In fail-fast mode, the branch is not pushed at all
+        if another branch has already failed to be pushed.
+
+        Return the returncode of push_incrementally()
+        """
+        if self.options.fail_fast and self.has_failed_branches():
+            return RETURNCODE_OK
+        #
+        local_branch = f'refs/heads/{branch_name}'
+        remote_branch = f'refs/remotes/{ORIGIN}/{branch_name}'
+        if remote_branch in self.remote_refs:
+            LOGGER.info(
+                'Branch %r already exists on origin,'
+                ' so pushing missing commits only…', branch_name)
+            commits_range = (f'{remote_branch}..{local_branch}',)
         else:
-            logging.info(
-                'Branch already exists on origin,'
-                ' so pushing missing commits only…')
-            commits_range = f'{remote_branch}..HEAD'
-        #
-        number_to_push = len(
-            self.git.log(
-                '--first-parent',
-                '--pretty=format:x',
-                commits_range,
-                log_output=False).splitlines())
+            LOGGER.info(
+                'Branch %r does not exist yet on origin,'
+                ' pushing all missing commits…', branch_name)
+            commits_range = (local_branch, '--not', f'--remotes={ORIGIN}')
         #
-        if not number_to_push:
-            logging.info('Branch %r is already up to date.', branch_name)
-            self.branches.successful_pushes.append(branch_name)
+        commit_ids = self.git.rev_list(
+            '--first-parent', *commits_range, log_output=False).split()
+        if not commit_ids:
+            LOGGER.info('Branch %r is already up to date.', branch_name)
+            with self.lock:
+                self.branches.successful_pushes[branch_name] = None
+            #
             return RETURNCODE_OK
         #
-        return self.push_incrementally(branch_name, number_to_push)
+        return self.push_incrementally(branch_name, commit_ids)
+
+    def has_failed_branches(self):
+        """Return True if any branch failed to be pushed"""
+        with self.lock:
+            return bool(self.branches.failed_pushes)
+        #
+
+    async def push_tag_chunk(self, tag_names, semaphore):
+        """Coroutine pushing the given tags using a single
+        git push command (as soon as the semaphore allows it),
+        retrying transient errors as in push_with_backoff().
+        If that fails, split the tags into halves and push these
+        separately until the failing tags are determined.
+
+        In fail-fast mode, the tags are skipped instead
+        if another tag has already failed to be pushed.
+
+        Return the highest returncode encountered
+        """
+        refspecs = [f'refs/tags/{tag_name}:refs/tags/{tag_name}'
+                    for tag_name in tag_names]
+        async with semaphore:
+            if self.options.fail_fast and self.tags.failed_pushes:
+                self.tags.skipped_pushes.update(
+                    dict.fromkeys(tag_names, 'previous_errors'))
+                return RETURNCODE_OK
+            #
+            for attempt in range(self.options.batch_backoff_tries):
+                if attempt:
+                    delay = get_retry_delay(attempt)
+                    LOGGER.info('Retrying in %.1f seconds…', delay)
+                    await asyncio.sleep(delay)
+                #
+                push_result = await self.git.push_result_async(
+                    ORIGIN, *refspecs)
+                push_returncode = push_result.returncode
+                if not push_returncode \
+                        or not is_transient_push_error(push_result.stdout):
+                    break
+                #
+            #
+        #
+        if not push_returncode:
+            self.tags.successful_pushes.update(dict.fromkeys(tag_names))
+            return RETURNCODE_OK
+        #
+        if len(tag_names) == 1:
+            self.tags.failed_pushes[tag_names[0]] = \
+                f'returncode: {push_returncode}'
+            return push_returncode
+        #
+        LOGGER.info(
+            'Pushing %s tags failed, splitting them up…', len(tag_names))
+        middle = len(tag_names) // 2
+        return max(
+            await asyncio.gather(
+                self.push_tag_chunk(tag_names[:middle], semaphore),
+                self.push_tag_chunk(tag_names[middle:], semaphore)))
+
+    async def push_tag_chunks(self, tag_names):
+        """Coroutine pushing the given tags in chunks
+        of up to TAG_PUSH_CHUNK_SIZE tags (but not more than
+        the maximum batch size),
+        with up to self.options.jobs pushes running concurrently.
+        The tags are distributed evenly if there are not enough
+        for full chunks on all jobs.
+
+        Return the highest returncode encountered
+        """
+        semaphore = asyncio.Semaphore(self.options.jobs)
+        chunk_size = max(
+            1,
+            min(TAG_PUSH_CHUNK_SIZE,
+                self.options.maximum_batch_size,
+                -(-len(tag_names) // self.options.jobs)))
+        results = await asyncio.gather(
+            *[self.push_tag_chunk(
+                tag_names[start_index:start_index + chunk_size],
+                semaphore)
+              for start_index in range(0, len(tag_names), chunk_size)])
+        return max(results, default=RETURNCODE_OK)
 
     def push_tags(self):
-        """Push all tags, one by one
+        """Push all tags, in concurrent chunks
+        of up to TAG_PUSH_CHUNK_SIZE tags
 
         Return the highest returncode encountered
         """
@@ -574,44 +900,44 @@ class FullPush:
                 'Wrong method, use push_everything_globally()!')
         #
         # Determine commits not pushed to remote
+        # (querying all branches concurrently).
+        # Branches that do not exist on origin (yet)
+        # are compared against all remote-tracking branches.
+        self.remote_refs = self.get_remote_refs()
         commits_not_pushed = set()
+        log_arguments_sequence = []
         for branch_name in self.branches.names:
-            commits_not_pushed.update(
-                self.git.log(
-                    '--first-parent',
-                    '--pretty=format:%H',
-                    f'{ORIGIN}/{branch_name}..{branch_name}',
-                    log_output=False).splitlines())
+            if f'refs/remotes/{ORIGIN}/{branch_name}' in self.remote_refs:
+                commits_range = (f'{ORIGIN}/{branch_name}..{branch_name}',)
+            else:
+                commits_range = (branch_name, '--not', f'--remotes={ORIGIN}')
+            #
+            log_arguments_sequence.append(
+                ('log', '--first-parent', '--pretty=format:%H',
+                 *commits_range))
         #
-        highest_returncode = RETURNCODE_OK
+        for log_output in self.git.get_many_outputs(
+                log_arguments_sequence, log_output=False):
+            commits_not_pushed.update(log_output.splitlines())
+        #
+        tags_to_push = []
         for current_tag in self.tags.names:
-            tagref = f'refs/tags/{current_tag}'
-            tagged_commit = self.git.log(
-                '--first-parent',
-                '--pretty=format:%H',
-                '--skip=1',
-                '-n', '1',
-                tagref)
+            # First parent of the tagged commit, resolved through
+            # the persistent cat-file session instead of a git log call
+            tagged_commit = self.git.cat_file_check.get_object_name(
+                f'refs/tags/{current_tag}~1')
             if tagged_commit in commits_not_pushed:
-                logging.warning(
+                LOGGER.warning(
                     'Skipping %r: %s not in remote repository',
                     current_tag, tagged_commit)
                 self.tags.skipped_pushes[current_tag] = \
                     'tagged commit not in origin'
                 continue
             #
-            push_returncode = self.git.push(
-                ORIGIN, f'{tagref}:{tagref}',
-                exit_on_error=False)
-            if push_returncode:
-                self.tags.failed_pushes[current_tag] = \
-                    f'returncode: {push_returncode}'
-            else:
-                self.tags.successful_pushes.append(current_tag)
-            #
-            highest_returncode = max(push_returncode, highest_returncode)
+            tags_to_push.append(current_tag)
         #
-        return highest_returncode
+        return processwrappers.run_coroutine(
+            self.push_tag_chunks(tags_to_push))
 
 
 #
@@ -619,6 +945,36 @@ class FullPush:
 #
 
 
+def get_retry_delay(attempt):
+    """Return the delay in seconds before retry number attempt:
+    exponential backoff with random jitter, limited to
+    PUSH_RETRY_MAX_DELAY
+    """
+    return min(
+        PUSH_RETRY_MAX_DELAY,
+        PUSH_RETRY_BASE_DELAY * 2 ** attempt * (0.5 + random.random()))
+
+
+def is_transient_push_error(output):
+    """Return True if the push error output (bytes)
+    indicates a transient error worth retrying
+    """
+    if PRX_STRUCTURAL_PUSH_ERROR.search(output):
+        return False
+    #
+    return bool(PRX_TRANSIENT_PUSH_ERROR.search(output))
+
+
+@functools.lru_cache(maxsize=1)
+def get_version():
+    """Return the script version, read from version.txt
+    on first call only
+    """
+    with open(VERSION_FILE_PATH, mode='rt') as version_file:
+        return version_file.read().strip()
+    #
+
+
 def __get_arguments():
     """Parse command line arguments"""
     argument_parser = argparse.ArgumentParser(
@@ -652,10 +1008,29 @@ def __get_arguments():
         ' During the incremental push, the (effective) batch size'
         ' will be adjusted automatically in the range between 1'
         ' and %(metavar)s, depending on the success or failure of pushes.')
+    argument_parser.add_argument(
+        '--batch-backoff-tries',
+        metavar='TRIES',
+        type=int,
+        default=DEFAULT_PUSH_TRIES,
+        help='Try each push up to %(metavar)s times'
+        ' (with increasing delays) before giving up'
+        ' resp. reducing the batch size (default: %(default)s).')
+    argument_parser.add_argument(
+        '--jobs',
+        metavar='JOBS',
+        type=int,
+        default=DEFAULT_JOBS,
+        help='Push branches resp. tags with up to %(metavar)s concurrent'
+        ' git push commands during an incremental push'
+        ' (default branches are pushed first, one after another;'
+        ' default: three quarters of the number of CPUs, at least 1).')
     argument_parser.add_argument(
         '--fail-fast',
         action='store_true',
-        help='Exit directly after the first branch failed to be pushed.')
+        help='Exit directly after the first branch failed to be pushed,'
+        ' and do not start any more tag pushes after the first tag'
+        ' failed to be pushed.')
     argument_parser.add_argument(
         '--ignore-missing-credential-helper',
         action='store_true',
@@ -665,6 +1040,14 @@ def __get_arguments():
         gitwrapper.exit_with_error(
             'Invalid batch size %s!', arguments.maximum_batch_size)
     #
+    if arguments.batch_backoff_tries < 1:
+        gitwrapper.exit_with_error(
+            'Invalid number of tries %s!', arguments.batch_backoff_tries)
+    #
+    if arguments.jobs < 1:
+        gitwrapper.exit_with_error(
+            'Invalid number of jobs %s!', arguments.jobs)
+    #
     logging.basicConfig(format=MESSAGE_FORMAT_WITH_LEVELNAME,
                         level=arguments.loglevel)
     #
@@ -675,8 +1058,18 @@ def main(arguments):
     """Main routine, calling functions from above as required.
     Returns a returncode which is used as the script's exit code.
     """
+    # Set the language in the own environment once,
+    # so the git subprocesses can simply inherit it
+    # instead of receiving a copy of the environment each
+    os.environ[ENV_LANG] = 'C'
     full_push = FullPush(arguments)
-    return full_push.run()
+    try:
+        return full_push.run()
+    finally:
+        # Terminate the persistent git process explicitly
+        # instead of relying on garbage collection
+        full_push.git.close()
+    #
 
 
 if __name__ == '__main__':
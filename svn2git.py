@@ -27,6 +27,7 @@ import sys
 # local module
 
 import gitwrapper
+import processwrappers
 
 
 #
@@ -34,6 +35,8 @@ import gitwrapper
 #
 
 
+LOGGER = logging.getLogger(__name__)
+
 DEFAULT_AUTHORS_FILE = '~/.svn2git/authors'
 
 DEFAULT_BRANCHES = 'branches'
@@ -43,8 +46,15 @@ DEFAULT_TRUNK = 'trunk'
 MESSAGE_FORMAT_PURE = '%(message)s'
 MESSAGE_FORMAT_WITH_LEVELNAME = '%(levelname)-8s\u2551 %(message)s'
 
-PRX_SVNTAGS_PREFIX = re.compile(r'^svn/tags/')
-PRX_SVN_PREFIX = re.compile(r'^svn/')
+# Name prefixes of remote SVN branches and tags
+# (removed by slicing instead of regular expression substitution,
+# str.removeprefix() is available only from Python 3.9 on)
+SVN_PREFIX = 'svn/'
+SVN_TAGS_PREFIX = 'svn/tags/'
+
+# Ref name prefixes of local and remote branches
+REFS_HEADS_PREFIX = 'refs/heads/'
+REFS_REMOTES_PREFIX = 'refs/remotes/'
 
 RETURNCODE_OK = 0
 RETURNCODE_ERROR = 1
@@ -55,21 +65,36 @@ ENV['LANG'] = 'C'       # Prevent command output translation
 # Git executable
 GIT = 'git'
 
+# Perl executable (required by git svn anyway)
+# and the Perl code compiling the regular expression
+# from its first argument, like git svn does with --ignore-paths
+PERL = 'perl'
+PERL_COMPILE_REGEX = 'qr/$ARGV[0]/'
+
 # Config items
 CI_USER_NAME = 'user.name'
 CI_USER_EMAIL = 'user.email'
 
+# Minimum git version supporting 'git config --local'
+MIN_GIT_VERSION_CONFIG_LOCAL = (1, 8)
+
+# git version from which on tracking information
+# cannot be set up for remote SVN branches (actually 1.8.3.2)
+MIN_GIT_VERSION_NO_SVN_TRACKING = (1, 8, 4)
+
 # Commit data keys and pretty-printing formats
 CD_COMMENT = 'commit comment'
 CD_DATE = 'commit date'
 CD_AUTHOR_NAME = 'commit author name'
 CD_AUTHOR_EMAIL = 'commit author email'
 
+# git for-each-ref format fields
+# (%(committerdate:iso) matches the git log format %ci)
 COMMIT_DATA_FORMATS = {
-    CD_COMMENT: '%s',
-    CD_DATE: '%ci',
-    CD_AUTHOR_NAME: '%an',
-    CD_AUTHOR_EMAIL: '%ae'}
+    CD_COMMENT: '%(subject)',
+    CD_DATE: '%(committerdate:iso)',
+    CD_AUTHOR_NAME: '%(authorname)',
+    CD_AUTHOR_EMAIL: '%(authoremail)'}
 
 # 'git config' scopes
 CONFIG_GLOBAL = '--global'
@@ -81,7 +106,8 @@ ENV_GIT_COMMITTER_DATE = 'GIT_COMMITTER_DATE'
 SCRIPT_NAME = os.path.basename(__file__)
 
 # Read the (script) version from version.txt
-with open(os.path.join(os.path.dirname(sys.argv[0]), 'version.txt'),
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'version.txt'),
           mode='rt') as version_file:
     VERSION = version_file.read().strip()
 #
@@ -108,7 +134,7 @@ class Migration:
     def run(self):
         """Execute the migration depending on the arguments"""
         start_time = datetime.datetime.now()
-        logging.info(
+        LOGGER.info(
             '%s %s started at %s',
             SCRIPT_NAME,
             VERSION,
@@ -129,23 +155,23 @@ class Migration:
         self._fix_branches()
         self._fix_tags()
         self._fix_trunk()
-        logging.info('--- Optimize Repository ---')
+        LOGGER.info('--- Optimize Repository ---')
         self.git.gc_()
         finish_time = datetime.datetime.now()
-        logging.info(
+        LOGGER.info(
             '%s %s finished at %s',
             SCRIPT_NAME,
             VERSION,
             finish_time)
         duration = (finish_time - start_time).total_seconds()
-        logging.info('Elapsed time: %d seconds', duration)
+        LOGGER.info('Elapsed time: %d seconds', duration)
         return RETURNCODE_OK
 
     def verify_working_tree_is_clean(self):
         """Check if there are no pending local changes.
         Exit if there are any.
         """
-        logging.info('--- Verify working tree is clean ---')
+        LOGGER.info('--- Verify working tree is clean ---')
         tree_status_output = self.git.status(
             '--porcelain', '--untracked-files=no')
         if tree_status_output.strip():
@@ -157,7 +183,7 @@ class Migration:
 
     def __do_git_svn_init(self):
         """Execute the 'git svn init' command"""
-        logging.info('--- Do Git SVN Init ---')
+        LOGGER.info('--- Do Git SVN Init ---')
         arguments = ['--prefix=svn/']
         if self.options.username:
             arguments.append(f'--username={self.options.username}')
@@ -186,7 +212,7 @@ class Migration:
 
     def __do_git_svn_fetch(self):
         """Execute the 'git svn fetch' command"""
-        logging.info('--- Do Git SVN Fetch ---')
+        LOGGER.info('--- Do Git SVN Fetch ---')
         arguments = []
         if self.options.revision:
             revisions_range = self.options.revision.split(':')
@@ -200,26 +226,26 @@ class Migration:
             arguments.append(f'{from_revision}:{to_revision}')
         #
         if self.options.exclude:
-            exclude_prefixes = []
-            if self.options.trunk_prefix:
-                exclude_prefixes.append(f'{self.options.trunk_prefix}[/]')
-            #
-            for tags_prefix in self.options.tags_prefixes:
-                exclude_prefixes.append(f'{tags_prefix}[/][^/]+[/]')
+            regex = get_ignore_paths_regex(
+                self.options.trunk_prefix,
+                self.options.tags_prefixes,
+                self.options.branches_prefixes,
+                self.options.exclude)
+            # Fail before the (possibly very long) fetch
+            # if the regular expression is invalid
+            regex_error = get_perl_regex_error(regex)
+            if regex_error:
+                gitwrapper.exit_with_error(
+                    'Invalid --exclude regular expression:\n%s',
+                    regex_error)
             #
-            for branches_prefix in self.options.branches_prefixes:
-                exclude_prefixes.append(f'{branches_prefix}[/][^/]+[/]')
-            #
-            regex = '^(?:%s)(?:%s)' % (
-                '|'.join(exclude_prefixes),
-                '|'.join(self.options.exclude))
             arguments.append(f'--ignore-paths={regex}')
         #
         return self.git.svn_fetch(*arguments)
 
     def _clone(self):
         """Clone the Subversion repository"""
-        logging.info('=== Clone ===')
+        LOGGER.info('=== Clone ===')
         self.__do_git_svn_init()
         # Determine initial branch name
         with open(os.path.join('.git', 'HEAD'), mode='rt') as head_file:
@@ -230,46 +256,51 @@ class Migration:
                 r'\Aref:\s+refs/heads/(\w+)',
                 head_data).group(1)
         except AttributeError:
-            logging.warning(
+            LOGGER.warning(
                 'Could not read the initial branch name from .git/HEAD,')
-            logging.warning('so guessing %r.', self.__initial_branch)
+            LOGGER.warning('so guessing %r.', self.__initial_branch)
         else:
-            logging.info('Initial branch name: %r', self.__initial_branch)
+            LOGGER.info('Initial branch name: %r', self.__initial_branch)
         #
         # Check if local config is possible
-        logging.debug(
+        LOGGER.debug(
             'Testing if the --local option is supported by git config …')
-        config_output = self.git.config.get(CI_USER_NAME, exit_on_error=False)
-        if 'unknown option' in config_output.lower():
+        if gitwrapper.get_git_version(self.git.git_command) \
+                < MIN_GIT_VERSION_CONFIG_LOCAL:
             self.git.set_config(local_config_enabled=False)
-            logging.debug(
+            LOGGER.debug(
                 '[no] --local option is not supported,'
                 ' omitting it in future config commands.')
         else:
-            logging.debug(
+            LOGGER.debug(
                 '[yes] --local option is supported.')
         #
         if os.path.isfile(self.options.authors_file):
-            logging.info('Using authors file: %s', self.options.authors_file)
+            LOGGER.info('Using authors file: %s', self.options.authors_file)
             self.git.config('svn.authorsfile', self.options.authors_file)
         #
         self.__do_git_svn_fetch()
 
     def _fix_branches(self):
         """Fix branches"""
-        logging.info('--- Fix Branches ---')
+        LOGGER.info('--- Fix Branches ---')
         svn_branches = {
             branch for branch in self.remote_branches - self.tags
-            if PRX_SVN_PREFIX.match(branch)}
-        logging.debug('Found branches: %r', svn_branches)
+            if branch.startswith(SVN_PREFIX)}
+        LOGGER.debug('Found branches: %r', svn_branches)
         if self.options.rebase:
-            logging.info('Doing the SVN fetch; this will take some time …')
+            LOGGER.info('Doing the SVN fetch; this will take some time …')
             self.git.svn_fetch()
         #
-        cannot_setup_tracking_information = False
+        # Local branches are created without checking them out
+        # (which would update the working tree each time),
+        # because _fix_trunk() checks out the final branch anyway.
+        cannot_setup_tracking_information = \
+            gitwrapper.get_git_version(self.git.git_command) \
+            >= MIN_GIT_VERSION_NO_SVN_TRACKING
         legacy_svn_branch_tracking_message_displayed = False
         for branch in sorted(svn_branches):
-            branch = PRX_SVN_PREFIX.sub('', branch)
+            branch = branch[len(SVN_PREFIX):]
             remote_svn_branch = f'remotes/svn/{branch}'
             if self.options.rebase and (branch in self.local_branches
                                         or branch == DEFAULT_TRUNK):
@@ -287,7 +318,7 @@ class Migration:
                 continue
             #
             if cannot_setup_tracking_information:
-                self.git.checkout('-b', branch, remote_svn_branch)
+                self.git.branch(branch, remote_svn_branch)
             else:
                 track_output = self.git.branch(
                     '--track', branch, remote_svn_branch, exit_on_error=False)
@@ -305,13 +336,13 @@ class Migration:
                 # that they should use the newer --rebase option.
                 if 'cannot setup tracking information' in track_output.lower():
                     cannot_setup_tracking_information = True
-                    logging.debug('The above "fatal" message can be ignored.')
-                    logging.debug(
+                    LOGGER.debug('The above "fatal" message can be ignored.')
+                    LOGGER.debug(
                         'It just means your Git version is 1.8.3.2 or newer.')
-                    self.git.checkout('-b', branch, remote_svn_branch)
+                    self.git.branch(branch, remote_svn_branch)
                 else:
                     if not legacy_svn_branch_tracking_message_displayed:
-                        logging.warning('*' * 68)
+                        LOGGER.warning('*' * 68)
                         for line in (
                                 'svn2git warning:',
                                 'Tracking remote SVN branches is deprecated.',
@@ -319,45 +350,62 @@ class Migration:
                                 ' will be created without tracking.',
                                 'If you have to resync your branches, run:',
                                 '  svn2git.py --rebase'):
-                            logging.warning(line)
-                        logging.warning('*' * 68)
+                            LOGGER.warning(line)
+                        LOGGER.warning('*' * 68)
                         legacy_svn_branch_tracking_message_displayed = True
                     #
-                    self.git.checkout(branch)
                 #
             #
         #
 
+    def __get_tags_commit_data(self):
+        """Return a dict of commit data dicts for all svn/tags/…
+        branches (keyed by branch name), from the (latest) commit
+        of each branch, determined using a single git for-each-ref call
+        """
+        ref_format = '%00'.join(('%(refname)', *COMMIT_DATA_FORMATS.values()))
+        all_commit_data = {}
+        for line in self.git.for_each_ref(
+                f'--format={ref_format}',
+                f'{REFS_REMOTES_PREFIX}svn/tags/').splitlines():
+            ref_name, *values = line.split('\0')
+            commit_data = dict(zip(COMMIT_DATA_FORMATS, values))
+            # %(authoremail) includes the angle brackets (unlike %ae)
+            commit_data[CD_AUTHOR_EMAIL] = \
+                commit_data[CD_AUTHOR_EMAIL].strip('<>')
+            all_commit_data[ref_name[len(REFS_REMOTES_PREFIX):]] = \
+                commit_data
+        #
+        return all_commit_data
+
     def _fix_tags(self):
         """Convert the svn/tags/* branches to git tags"""
-        logging.info('--- Fix Tags ---')
+        LOGGER.info('--- Fix Tags ---')
+        # Read all configured values at once
+        config_values = self.git.config.list_values(exit_on_error=False)
         saved_originals = {
-            key: self.git.config.get(key, exit_on_error=False).strip()
+            key: config_values.get(key, '').strip()
             for key in (CI_USER_NAME, CI_USER_EMAIL)}
+        # Get commit data from the (latest) commit of each
+        # svn/tags/… branch (following the convention for svn,
+        # there should only be one) at once
+        tag_names = sorted(tag_name.strip() for tag_name in self.tags)
+        all_commit_data = self.__get_tags_commit_data()
         try:
-            for tag_name in sorted(self.tags):
-                # Get commit data from the (latest) commit of a
-                # svn/tags/… branch (following the convention for svn,
-                # there should only be one),
-                # produce a git tag using these data
+            for tag_name in tag_names:
+                # Produce a git tag using the commit data
                 # and delete the now-obsolete branch.
-                tag_name = tag_name.strip()
-                tag_id = PRX_SVNTAGS_PREFIX.sub('', tag_name)
-                commit_data = {
-                    key: self.git.log(
-                        '-1', f'--pretty=format:{value}', tag_name)
-                    for (key, value) in COMMIT_DATA_FORMATS.items()}
+                tag_id = tag_name[len(SVN_TAGS_PREFIX):]
+                commit_data = all_commit_data[tag_name]
                 self.git.config(CI_USER_NAME, commit_data[CD_AUTHOR_NAME])
                 self.git.config(CI_USER_EMAIL, commit_data[CD_AUTHOR_EMAIL])
-                original_git_committer_date = ENV.get(ENV_GIT_COMMITTER_DATE)
-                ENV[ENV_GIT_COMMITTER_DATE] = commit_data[CD_DATE]
+                # Use a per-command copy of the environment
+                # instead of modifying (and restoring) the global one
+                tag_env = dict(ENV)
+                tag_env[ENV_GIT_COMMITTER_DATE] = commit_data[CD_DATE]
                 self.git.tag(
-                    '-a', '-m', commit_data[CD_COMMENT], tag_id, tag_name)
-                if original_git_committer_date is None:
-                    del ENV[ENV_GIT_COMMITTER_DATE]
-                else:
-                    ENV[ENV_GIT_COMMITTER_DATE] = original_git_committer_date
-                #
+                    '-a', '-m', commit_data[CD_COMMENT], tag_id, tag_name,
+                    env=tag_env)
                 self.git.branch('-d', '-r', tag_name)
             #
         finally:
@@ -377,7 +425,7 @@ class Migration:
 
     def _fix_trunk(self):
         """Fix trunk."""
-        logging.info('--- Fix Trunk ---')
+        LOGGER.info('--- Fix Trunk ---')
         if DEFAULT_TRUNK in self.remote_branches and not self.options.rebase:
             self.git.checkout('svn/trunk')
             self.git.branch('-D', self.__initial_branch)
@@ -386,56 +434,45 @@ class Migration:
             self.git.checkout('-f', self.__initial_branch)
         #
 
-    def find_branches(self, remote=False):
-        """Yield local or remote branches,
-        taking care to ignore console color codes and ignoring the
-        '*' character used to indicate the currently selected branch.
-        """
-        arguments = ['--no-color']
-        if remote:
-            arguments.append('-r')
-        #
-        for branch in self.git.branch(*arguments).splitlines():
-            branch = branch.replace('*', '').strip()
-            if branch:
-                yield branch
-            #
-        #
-
     def _get_branches(self):
         """Get local and remote branches, and tags.
         Store each of them in the appropriate set.
         """
-        logging.info('--- Get Branches ---')
-        self.local_branches = set(self.find_branches())
-        self.remote_branches = set(self.find_branches(remote=True))
+        LOGGER.info('--- Get Branches ---')
+        # A single git for-each-ref call lists both local and remote
+        # branches, without color codes or a current branch marker
+        self.local_branches = set()
+        self.remote_branches = set()
+        for ref_name in self.git.for_each_ref(
+                '--format=%(refname)',
+                REFS_HEADS_PREFIX,
+                REFS_REMOTES_PREFIX).splitlines():
+            if ref_name.startswith(REFS_HEADS_PREFIX):
+                self.local_branches.add(ref_name[len(REFS_HEADS_PREFIX):])
+            elif ref_name.startswith(REFS_REMOTES_PREFIX):
+                self.remote_branches.add(
+                    ref_name[len(REFS_REMOTES_PREFIX):])
+            #
+        #
         # Tags are remote branches that start with "tags/".
         self.tags = {
             single_branch for single_branch in self.remote_branches
-            if PRX_SVNTAGS_PREFIX.match(single_branch)}
+            if single_branch.startswith(SVN_TAGS_PREFIX)}
 
     def _get_rebasebranch(self):
         """Rebase the specified branch"""
-        logging.info('--- Get Rebasebranch ---')
-        local_branch_candidates = {
-            branch for branch in self.local_branches
-            if branch == self.options.rebasebranch}
-        remote_branch_candidates = {
-            branch for branch in self.remote_branches
-            if self.options.rebasebranch in branch}
-        try:
-            found_local_branch = local_branch_candidates.pop()
-        except KeyError:
+        LOGGER.info('--- Get Rebasebranch ---')
+        # Local branch names are unique,
+        # so a simple set membership test is sufficient
+        found_local_branch = self.options.rebasebranch
+        if found_local_branch not in self.local_branches:
             gitwrapper.exit_with_error(
                 'No local branches named %r found.',
                 self.options.rebasebranch)
         #
-        if local_branch_candidates:
-            gitwrapper.exit_with_error(
-                'Too many matching local branches found: %s, %s.',
-                found_local_branch,
-                ', '.join(local_branch_candidates))
-        #
+        remote_branch_candidates = {
+            branch for branch in self.remote_branches
+            if self.options.rebasebranch in branch}
         if not remote_branch_candidates:
             gitwrapper.exit_with_error(
                 'No remote branches named %r found.',
@@ -449,8 +486,8 @@ class Migration:
         #
         self.local_branches = {found_local_branch}
         self.remote_branches = remote_branch_candidates
-        logging.info('Found local branch %r.', found_local_branch)
-        logging.info(
+        LOGGER.info('Found local branch %r.', found_local_branch)
+        LOGGER.info(
             'Found remote branches %s.'
             ' and '.join(repr(branch) for branch in self.remote_branches))
         # We only rebase the specified branch
@@ -462,6 +499,59 @@ class Migration:
 #
 
 
+def __iter_exclude_prefixes(trunk_prefix, container_prefixes):
+    """Yield the (escaped) path prefix patterns for the --exclude option"""
+    if trunk_prefix:
+        yield f'{re.escape(trunk_prefix)}/'
+    #
+    # Tags and branches share the same pattern,
+    # so their prefixes are factored into a single alternative
+    if container_prefixes:
+        yield '(?:%s)/[^/]+/' % '|'.join(
+            re.escape(prefix) for prefix in container_prefixes)
+    #
+
+
+def get_ignore_paths_regex(trunk_prefix,
+                           tags_prefixes,
+                           branches_prefixes,
+                           excludes):
+    """Return the regular expression for git svn fetch --ignore-paths
+    from the prefix and exclude options.
+    The exclude expressions are Perl regular expressions
+    evaluated by git svn, so they are passed through unchanged.
+    """
+    return '^(?:%s)(?:%s)' % (
+        '|'.join(
+            __iter_exclude_prefixes(
+                trunk_prefix, [*tags_prefixes, *branches_prefixes])),
+        '|'.join(excludes))
+
+
+def get_perl_regex_error(regex):
+    """Return the error message if perl cannot compile regex,
+    or None if it can. If perl cannot be run at all,
+    log a warning and return None (leaving the error to git svn).
+    """
+    try:
+        perl_result = processwrappers.get_command_result(
+            [PERL, '-e', PERL_COMPILE_REGEX, '--', regex],
+            check=False,
+            encoding='UTF-8',
+            errors='replace',
+            loglevel=logging.DEBUG)
+    except OSError as error:
+        LOGGER.warning(
+            'Could not check the --exclude regular expressions: %s', error)
+        return None
+    #
+    if perl_result.returncode:
+        return perl_result.stderr.strip() or \
+            f'{PERL} returncode {perl_result.returncode}'
+    #
+    return None
+
+
 def __get_arguments():
     """Parse command line arguments"""
     argument_parser = argparse.ArgumentParser(
@@ -36,6 +36,8 @@ import processwrappers
 #
 
 
+LOGGER = logging.getLogger(__name__)
+
 CHUNK_SIZE = 5000
 
 FS_MESSAGE = '%(levelname)-8s\u2551 %(message)s'
@@ -50,7 +52,8 @@ RETURNCODE_ERROR = 1
 SCRIPT_NAME = os.path.basename(__file__)
 
 # Read the (script) version from version.txt
-with open(os.path.join(os.path.dirname(sys.argv[0]), 'version.txt'),
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'version.txt'),
           mode='rt') as version_file:
     VERSION = version_file.read().strip()
 #
@@ -66,7 +69,7 @@ ENCODING = locale.getpreferredencoding()
 
 def log_separator(level=logging.INFO):
     """Log a horizontal line as separator"""
-    logging.log(level, '-' * 72)
+    LOGGER.log(level, '-' * 72)
 
 
 def revision_range(start, end):
@@ -136,26 +139,26 @@ class LogExaminer:
         expected_revisions = set(range(1, self.head_revision + 1))
         missing_revisions = expected_revisions - self.seen_revisions
         if missing_revisions:
-            logging.error(
+            LOGGER.error(
                 '%s found missing revisions:',
                 SCRIPT_NAME)
-            logging.error(', '.join(ranges_list(missing_revisions)))
+            LOGGER.error(', '.join(ranges_list(missing_revisions)))
             if self.in_repository_root:
-                logging.error(
+                LOGGER.error(
                     'You probably need to execute "%s update".',
                     self.options.svn_command)
             else:
-                logging.error(
+                LOGGER.error(
                     'Try to call this script again from the working copy'
                     ' root directory,')
-                logging.error(
+                LOGGER.error(
                     'but executing "%s update" won’t hurt either.',
                     self.options.svn_command)
             #
-            logging.error(
+            LOGGER.error(
                 'Anyway, it might be a better idea to provide the URL')
-            logging.error(self.repository_root)
-            logging.error('on the command line.')
+            LOGGER.error(self.repository_root)
+            LOGGER.error('on the command line.')
             log_separator(level=logging.ERROR)
             return RETURNCODE_ERROR
         #
@@ -170,7 +173,7 @@ class LogExaminer:
         self.seen_revisions.clear()
         highest_returncode = RETURNCODE_OK
         current_base = 1
-        logging.info(
+        LOGGER.info(
             'Reading the SVN log in chunks of %s revisions',
             self.options.chunk_size)
         while current_base <= self.head_revision:
@@ -183,17 +186,20 @@ class LogExaminer:
             if self.options.svn_url:
                 command.append(self.repository_root)
             #
-            process_result = processwrappers.get_command_result(command)
+            # Let the subprocess module decode the output once,
+            # replacing undecodable bytes instead of failing
+            process_result = processwrappers.get_command_result(
+                command, encoding=ENCODING, errors='replace')
             if process_result.stderr:
-                logging.error(process_result.stderr.decode(ENCODING))
+                LOGGER.error(process_result.stderr)
             #
             for revision_match in PRX_LOG_ENTRY.finditer(
-                    process_result.stdout.decode(ENCODING)):
+                    process_result.stdout):
                 revision = int(revision_match.group(1))
                 author = revision_match.group(2)
                 if revision in self.seen_revisions:
-                    logging.warning('Duplicated revision entry:')
-                    logging.warning(revision_match.group(0))
+                    LOGGER.warning('Duplicated revision entry:')
+                    LOGGER.warning(revision_match.group(0))
                 #
                 self.seen_revisions.add(revision)
                 try:
@@ -207,7 +213,7 @@ class LogExaminer:
             highest_returncode = max(
                 highest_returncode,
                 process_result.returncode)
-            logging.info('Examined %r revisions', current_end)
+            LOGGER.info('Examined %r revisions', current_end)
             current_base = current_end + 1
         #
         return highest_returncode
@@ -222,13 +228,14 @@ class LogExaminer:
         if url:
             command.append(url)
         #
-        raw_result = processwrappers.get_command_result(command, env=env)
+        raw_result = processwrappers.get_command_result(
+            command, env=env, encoding=ENCODING, errors='replace')
         if raw_result.stderr:
-            logging.error(raw_result.stderr.decode(ENCODING))
+            LOGGER.error(raw_result.stderr)
         #
         details = {}
         repository_root_relative = '^/'
-        for line in raw_result.stdout.decode(ENCODING).splitlines():
+        for line in raw_result.stdout.splitlines():
             if not line.split():
                 continue
             #
@@ -236,7 +243,7 @@ class LogExaminer:
             details[keyword] = value.strip()
         #
         if details['Relative URL'] != repository_root_relative:
-            logging.warning(
+            LOGGER.warning(
                 'Got unexpected relative URL %r (expected %r)',
                 details['Relative URL'],
                 repository_root_relative)
@@ -248,24 +255,24 @@ class LogExaminer:
         """Print generic statistics"""
         examined_revisions = len(self.seen_revisions)
         revisions_rate = examined_revisions / duration
-        logging.info('%s statistics', SCRIPT_NAME)
+        LOGGER.info('%s statistics', SCRIPT_NAME)
         log_separator()
-        logging.info(
+        LOGGER.info(
             'Examined %r revisions in %.3f seconds',
             examined_revisions,
             duration)
-        logging.info(
+        LOGGER.info(
             '(\u00f8 %.1f revisions per second).',
             revisions_rate)
         log_separator()
 
     def print_per_user_statistics(self):
         """Print per-user statistics"""
-        logging.info('%s per-user statistics', SCRIPT_NAME)
+        LOGGER.info('%s per-user statistics', SCRIPT_NAME)
         log_separator()
         for (author, revisions) in sorted(
                 self.revisions_by_author.items()):
-            logging.info(
+            LOGGER.info(
                 '%r commited %d revisions: %s',
                 author,
                 len(revisions),
@@ -278,18 +285,18 @@ class LogExaminer:
         and print statistics
         """
         start_time = datetime.datetime.now()
-        logging.info(
+        LOGGER.info(
             '%s %s started at %s',
             SCRIPT_NAME,
             VERSION,
             start_time)
-        logging.info('Repository Root: %s', self.repository_root)
-        logging.info('HEAD Revision:   %s', self.head_revision)
+        LOGGER.info('Repository Root: %s', self.repository_root)
+        LOGGER.info('HEAD Revision:   %s', self.head_revision)
         log_separator()
         highest_returncode = self._examine_log_chunks()
         done_time = datetime.datetime.now()
         log_separator()
-        logging.info(
+        LOGGER.info(
             '"%s log" highest returncode: %r',
             self.options.svn_command,
             highest_returncode)
@@ -303,7 +310,7 @@ class LogExaminer:
             self._check_for_missing_revisions(),
             highest_returncode)
         finish_time = datetime.datetime.now()
-        logging.info(
+        LOGGER.info(
             '%s %s finished at %s',
             SCRIPT_NAME,
             VERSION,